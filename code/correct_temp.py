@@ -35,80 +35,278 @@ Copyright:      (c) Bryn Morgan 2023
 
 # IMPORTS
 import os
+import functools
 import numpy as np
+import pandas as pd
+from scipy import stats
 
-# FUNCTIONS
+#-------------------------------------------------------------------------------
+# CALIBRATION REGISTRY
+#-------------------------------------------------------------------------------
 
-lin_dictK = {
-    'ALL': {
-        'Slope': 1.3372275455889693,
-        'Intercept': -100.3186114647923,
-        'R2': 0.9729385601878838,
-        'p': 4.659623104386496e-77,
-        'StandardError': 0.022761581779130145,
-        'n': 98.0
-    },
-    'SN52': {
-        'Slope': 1.3833264937415755,
-        'Intercept': -113.98306486902885,
-        'R2': 0.989836426080431,
-        'p': 1.7321813592697283e-87,
-        'StandardError': 0.015115307204487503,
-        'n': 88.0
-    },
-    'SN75': {
-        'Slope': 2.0420170197772127,
-        'Intercept': -302.5531588952041,
-        'R2': 0.9797085443176952,
-        'p': 4.673762542514119e-08,
-        'StandardError': 0.10390166764074067,
-        'n': 10.0
-    },
-    'TSM835' : {
-        'Slope': 1.45827975603128,
-        'Intercept': -133.7750913120778,
-        'R2': 0.8782068231891249,
-        'p': 6.334147950807622e-05,
-        'StandardError': 0.19200340440110228,
-        'n': 10
-    },
-    'TSM836' : {
-        'Slope': 1.6342506432252804,
-        'Intercept': -184.40744294056253,
-        'R2': 0.9495500801411989,
-        'p': 1.8082468902806203e-06,
-        'StandardError': 0.1331818287626371,
-        'n': 10
-    },
-}
+data_fold = os.path.join( os.path.dirname( __file__ ), os.path.pardir, 'data')
 
-lin_dictC = {
-    'ALL': {
-        'Slope': 1.3372275455889686,
-        'Intercept': -8.204907387165282,
-        'R2': 0.9729385601878832,
-        'p': 4.6596231043920595e-77,
-        'StandardError': 0.022761581779130423,
-        'n': 98.0
-    },
-    'SN52': {
-        'Slope': 1.3833264937415755,
-        'Intercept': -9.277433103517499,
-        'R2': 0.9898364260804314,
-        'p': 1.7321813592664788e-87,
-        'StandardError': 0.015115307204487172,
-        'n': 88.0
-    },
-    'SN75': {
-        'Slope': 2.0420170197772127,
-        'Intercept': -17.926209943058637,
-        'R2': 0.9797085443176954,
-        'p': 4.6737625425139105e-08,
-        'StandardError': 0.10390166764074009,
-        'n': 10.0
-    }
+cal_files = {
+    'K' : 't_eqs.csv',
+    'C' : 't_eqs_C.csv',
 }
 
+cal_cols = ['Slope', 'Intercept', 'R2', 'p', 'StandardError', 'n']
+
+
+class CalibrationRegistry():
+    """
+    Linear temperature calibrations for the UAV met sensors, keyed by sensor 
+    serial number (and optionally by the date from which each calibration is valid).
+
+    Coefficients are held as contiguous arrays (``slopes``, ``intercepts``, ...)
+    so that bulk corrections can index them directly.
+
+    Parameters
+    ----------
+    table : pandas.DataFrame
+        Calibration table indexed by sensor serial number with columns
+        Slope, Intercept, R2, p, StandardError, n. An optional `valid_from` 
+        column allows several versions of the calibration for a sensor; the 
+        latest version on or before a given date is used. A row for 'ALL' 
+        (the pooled calibration) is required and is used for unknown sensors.
+        Optional `RMSE` (residual standard deviation) and `x_mean` (mean 
+        uncorrected temperature of the calibration data) columns are required 
+        for prediction intervals.
+    """
+    def __init__(self, table):
+
+        table = self.validate(table)
+
+        self.table = table
+        # sensors
+        self.sensors = table.index.to_numpy()
+        # valid_from [ns since epoch]
+        self.valid_from = table['valid_from'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+        # coefficient arrays
+        self.slopes = np.ascontiguousarray(table['Slope'], dtype=float)
+        self.intercepts = np.ascontiguousarray(table['Intercept'], dtype=float)
+        self.std_errs = np.ascontiguousarray(table['StandardError'], dtype=float)
+        self.n = np.ascontiguousarray(table['n'], dtype=float)
+        self.rmse = np.ascontiguousarray(table['RMSE'], dtype=float)
+        self.x_mean = np.ascontiguousarray(table['x_mean'], dtype=float)
+        # row positions of each sensor's versions (sorted by valid_from)
+        self._rows = {
+            sn : np.flatnonzero(self.sensors == sn) for sn in pd.unique(self.sensors)
+        }
+
+    def __repr__(self):
+        class_name = type(self).__name__
+        return '{}(sensors={})'.format(class_name, list(self._rows))
+
+    def __contains__(self, sn):
+        return sn in self._rows
+
+    @classmethod
+    def from_csv(cls, file):
+        """
+        Read a calibration table (e.g. data/t_eqs.csv) into a registry.
+
+        Parameters
+        ----------
+        file : str
+            Filename of the calibration table.
+
+        Returns
+        -------
+        CalibrationRegistry
+        """
+        table = pd.read_csv(file, index_col=0)
+
+        return cls(table)
+
+    @staticmethod
+    def validate(table):
+        """
+        Check a calibration table and return a sorted copy with a `valid_from` column.
+
+        Raises
+        ------
+        ValueError
+            If columns are missing, coefficients are not finite, there is no 
+            'ALL' calibration, or a sensor has duplicate versions.
+        """
+        missing = [col for col in cal_cols if col not in table.columns]
+        if missing:
+            raise ValueError('Calibration table is missing columns: {}'.format(missing))
+
+        table = table.copy()
+        table.index = table.index.astype(str)
+        table.index.name = 'sn'
+        table[cal_cols] = table[cal_cols].astype(float)
+        for col in ['RMSE', 'x_mean']:
+            if col not in table.columns:
+                table[col] = np.nan
+            table[col] = table[col].astype(float)
+
+        bad = ~np.isfinite(table[['Slope', 'Intercept']]).all(axis=1)
+        if bad.any():
+            raise ValueError(
+                'Non-finite calibration coefficients for: {}'.format(list(table.index[bad]))
+            )
+        bad = table['RMSE'] <= 0.
+        if bad.any():
+            raise ValueError(
+                'Non-positive calibration RMSE for: {}'.format(list(table.index[bad]))
+            )
+        if 'ALL' not in table.index:
+            raise ValueError("Calibration table must contain an 'ALL' calibration.")
+
+        if 'valid_from' in table.columns:
+            table['valid_from'] = pd.to_datetime(table['valid_from']).fillna(pd.Timestamp.min)
+        else:
+            table['valid_from'] = pd.Timestamp.min
+        # Strip timezone so dates compare on wall-clock time
+        if getattr(table['valid_from'].dt, 'tz', None) is not None:
+            table['valid_from'] = table['valid_from'].dt.tz_localize(None)
+
+        dups = table.reset_index().duplicated(subset=['sn', 'valid_from'])
+        if dups.any():
+            raise ValueError(
+                'Duplicate calibrations for: {}'.format(list(table.index[dups.to_numpy()]))
+            )
+
+        table = table.reset_index().sort_values(['sn', 'valid_from'], kind='stable').set_index('sn')
+
+        return table
+
+    def get_index(self, sn='ALL', date=None):
+        """
+        Get the row index of the calibration to use for a sensor (or array of sensors).
+
+        Parameters
+        ----------
+        sn : str | array-like
+            Sensor serial number(s). Unknown or missing sensors use 'ALL'.
+        date : datetime-like | array-like, optional
+            Date(s) of the measurements. The default (None) uses the latest 
+            version of each calibration.
+
+        Returns
+        -------
+        idx : int | numpy.ndarray
+            Row index (indices) into the coefficient arrays.
+        """
+        scalar = (np.ndim(sn) == 0) and (np.ndim(date) == 0)
+        sn, date = np.broadcast_arrays(
+            np.atleast_1d(np.asarray(sn, dtype=object)), np.asarray(date, dtype=object)
+        )
+        if (date == None).all():
+            dates = np.full(sn.shape, np.iinfo(np.int64).max)
+        else:
+            dates = pd.to_datetime(date.ravel())
+            if dates.tz is not None:
+                dates = dates.tz_localize(None)
+            dates = dates.to_numpy(dtype='datetime64[ns]').astype(np.int64).reshape(sn.shape)
+
+        idx = np.empty(sn.shape, dtype=np.intp)
+        keys = np.array([k if k in self._rows else 'ALL' for k in sn.ravel()], dtype=object).reshape(sn.shape)
+        for key in pd.unique(keys.ravel()):
+            mask = keys == key
+            rows = self._rows[key]
+            pos = np.searchsorted(self.valid_from[rows], dates[mask], side='right') - 1
+            # Dates before the first version fall back to the first version
+            idx[mask] = rows[np.clip(pos, 0, len(rows) - 1)]
+
+        return idx.item() if scalar else idx
+
+    def get(self, sn='ALL', date=None) -> dict:
+        """
+        Get the calibration for a single sensor as a dictionary with the keys 
+        Slope, Intercept, R2, p, StandardError, n (and RMSE, x_mean if known).
+        """
+        row = self.table.iloc[self.get_index(sn, date)]
+
+        return row[cal_cols + [col for col in ['RMSE', 'x_mean'] if pd.notnull(row[col])]].to_dict()
+
+    def to_dict(self) -> dict:
+        """
+        Get the latest calibration of every sensor as a dictionary of dictionaries.
+        """
+        return {sn : self.get(sn) for sn in self._rows}
+
+    def correct(self, T, sn='ALL', date=None):
+        """
+        Correct temperature(s) using the calibration(s) for the given sensor(s).
+
+        Parameters
+        ----------
+        T : float | array-like
+            Temperature(s) to be corrected. Units must match the registry.
+        sn : str | array-like
+            Sensor serial number(s), broadcastable against `T`.
+        date : datetime-like | array-like, optional
+            Date(s) of the measurements, broadcastable against `T`.
+
+        Returns
+        -------
+        T_corr : float | numpy.ndarray
+            Corrected temperature(s).
+        """
+        idx = self.get_index(sn, date)
+
+        T_corr = f(T, self.slopes[idx], self.intercepts[idx])
+
+        return T_corr
+
+    def calc_pi(self, T, sn='ALL', date=None, alpha=0.05):
+        """
+        Calculate the prediction interval of corrected temperature(s).
+
+        Parameters
+        ----------
+        T : float | array-like
+            Uncorrected temperature(s).
+        sn : str | array-like
+            Sensor serial number(s), broadcastable against `T`.
+        date : datetime-like | array-like, optional
+            Date(s) of the measurements, broadcastable against `T`.
+        alpha : float | None, optional
+            Significance level of the interval, by default 0.05. If None, the 
+            standard error of the prediction is returned instead.
+
+        Returns
+        -------
+        T_pi : float | numpy.ndarray
+            Half-width of the prediction interval (or standard error).
+        """
+        idx = self.get_index(sn, date)
+
+        missing = ~(np.isfinite(self.rmse[idx]) & np.isfinite(self.x_mean[idx]))
+        if np.any(missing):
+            raise ValueError(
+                'No RMSE/x_mean in the calibration table for: {}'.format(
+                    list(pd.unique(self.sensors[np.atleast_1d(idx)[np.atleast_1d(missing)]]))
+                )
+            )
+
+        T_pi = calc_pi(
+            T, self.std_errs[idx], self.n[idx], rmse=self.rmse[idx], 
+            x_mean=self.x_mean[idx], alpha=alpha
+        )
+
+        return T_pi
+
+
+@functools.lru_cache(maxsize=None)
+def get_registry(units='K', data_fold=data_fold) -> CalibrationRegistry:
+    """
+    Load (once) the calibration registry for temperatures in units of `units` ('K' or 'C').
+    """
+    return CalibrationRegistry.from_csv(os.path.join(data_fold, cal_files[units]))
+
+
+lin_dictK = get_registry('K').to_dict()
+
+lin_dictC = get_registry('C').to_dict()
+
+# FUNCTIONS
+
 def f(x, a, b):
     y = a * x + b
     return y
@@ -127,10 +325,131 @@ def get_met_sn(flight):
 # os.path.join( os.path.dirname( __file__ ), os.path.pardir, os.path.pardir, 'data')
 
 
-def correct_Ta(T, lin_dict=lin_dictK, sn='ALL'):
+def calc_pi(T, std_err, n, rmse, x_mean, alpha=0.05):
+    """
+    Calculate the half-width of the prediction interval of a linear calibration.
+
+    Parameters
+    ----------
+    T : float | array-like
+        Uncorrected temperature(s).
+    std_err : float | array-like
+        Standard error of the calibration slope.
+    n : float | array-like
+        Number of observations in the calibration.
+    rmse : float | array-like
+        Residual standard deviation of the calibration.
+    x_mean : float | array-like
+        Mean uncorrected temperature of the calibration data.
+    alpha : float | None, optional
+        Significance level of the interval, by default 0.05. If None, the 
+        standard error of the prediction is returned.
+
+    Returns
+    -------
+    T_pi : float | numpy.ndarray
+        Half-width of the prediction interval [units of T].
+
+    Raises
+    ------
+    ValueError
+        If `rmse` or `x_mean` is unknown (nan).
+
+    Notes
+    -----
+    The prediction interval of the corrected temperature at |T| is
+
+    .. math::
+        t_{1-\\alpha/2, n-2} \\sqrt{ s^2 \\left(1 + \\frac{1}{n} \\right) + SE_b^2 (T - \\bar{T})^2 }
+
+    where s is the residual standard deviation and SE_b the standard error of 
+    the slope. s and the mean calibration temperature are read from the 
+    `RMSE` and `x_mean` columns of the calibration table (see derive_pi_stats()).
+    """
+    T = np.asarray(T, dtype=float)
+    rmse = np.asarray(rmse, dtype=float)
+    x_mean = np.asarray(x_mean, dtype=float)
+    if not (np.isfinite(rmse).all() and np.isfinite(x_mean).all()):
+        raise ValueError(
+            'The calibration RMSE and x_mean are required for prediction intervals.'
+        )
+
+    T_se = np.sqrt(rmse**2 * (1 + 1 / n) + std_err**2 * (T - x_mean)**2)
+
+    if alpha is None:
+        return T_se
 
-    ld = lin_dict.get(sn, 'ALL')
+    T_pi = stats.t.ppf(1 - alpha / 2, n - 2) * T_se
+
+    return T_pi
+
+
+def derive_pi_stats(table, T_ref):
+    """
+    Derive the `RMSE` and `x_mean` of calibrations from their fits, given a 
+    sample of reference temperatures representative of the calibration data.
+
+    For a least-squares line, R2 = 1 - SS_res / SS_yy and the line passes 
+    through the means, so with the mean and variance of the reference 
+    temperatures y taken from `T_ref`:
+
+    .. math::
+        s = \sqrt{ (1 - R^2) (n - 1) \mathrm{Var}(y) / (n - 2) }, \quad
+        \bar{T} = (\bar{y} - Intercept) / Slope
+
+    The shipped tables (data/t_eqs*.csv) were derived from the air temperatures 
+    of all flights (T_a_1 and T_a_2 of ramajal_all_met.csv). Replace them with 
+    the residuals of the fits if the calibration data are at hand.
+
+    Parameters
+    ----------
+    table : pandas.DataFrame
+        Calibration table (with columns Slope, Intercept, R2, n).
+    T_ref : array-like
+        Reference (corrected) temperatures, in the units of the table.
+
+    Returns
+    -------
+    table : pandas.DataFrame
+        Copy of `table` with the RMSE and x_mean columns filled.
+    """
+    T_ref = np.asarray(T_ref, dtype=float)
+    T_ref = T_ref[np.isfinite(T_ref)]
+    n = table['n'].astype(float)
+
+    return table.assign(
+        RMSE = np.sqrt((1 - table['R2']) * (n - 1) * T_ref.var(ddof=1) / (n - 2)),
+        x_mean = (T_ref.mean() - table['Intercept']) / table['Slope'],
+    )
+
+
+def correct_Ta(T, lin_dict=lin_dictK, sn='ALL', return_pi=False, alpha=0.05):
+
+    ld = lin_dict.get(sn, lin_dict['ALL'])
 
     T_corr = f(T, ld.get('Slope'), ld.get('Intercept'))
 
+    if return_pi:
+        T_pi = calc_pi(
+            T, ld.get('StandardError'), ld.get('n'), rmse=ld.get('RMSE', np.nan), 
+            x_mean=ld.get('x_mean', np.nan), alpha=alpha
+        )
+        return T_corr, T_pi
+
+    return T_corr
+
+
+def correct_Ta_bulk(T, sn='ALL', date=None, units='K', return_pi=False, alpha=0.05):
+    """
+    Correct many air temperatures at once (e.g. every record of every flight) 
+    using the cached calibration registry.
+    """
+    T = np.asarray(T, dtype=float)
+    registry = get_registry(units)
+
+    T_corr = registry.correct(T, sn=sn, date=date)
+
+    if return_pi:
+        return T_corr, registry.calc_pi(T, sn=sn, date=date, alpha=alpha)
+
     return T_corr
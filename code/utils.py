@@ -49,6 +49,6 @@ def read_results(file, out_fold=out_fold, tz=tz, dt_cols=['Flight','FlightDateTi
     df = pd.read_csv(os.path.join(out_fold, file), parse_dates=[0])
 
     for dt_col in dt_cols:
-        df[dt_col] = pd.to_datetime(df[dt_col], utc=True).dt.tz_convert(tz=tz)
+        df[dt_col] = pd.to_datetime(df[dt_col], utc=True, format='ISO8601').dt.tz_convert(tz=tz)
 
     return df
\ No newline at end of file
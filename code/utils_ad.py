@@ -0,0 +1,377 @@
+#!usr/bin/env python
+# -*- coding: utf-8 -*-
+#––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––
+
+__author__ = 'Bryn Morgan'
+__contact__ = 'bryn.morgan@geog.ucsb.edu'
+__copyright__ = '(c) Bryn Morgan 2023'
+
+__license__ = 'MIT'
+__date__ = 'Mon 19 Oct 26 10:12:44'
+__version__ = '1.0'
+__status__ = 'initial release'
+__url__ = ''
+
+"""
+
+Name:           utils_ad.py
+Compatibility:  Python 3.7.0
+Description:    Forward-mode automatic differentiation (dual numbers over numpy
+                arrays) of the one-source (calc_H/calc_LE) and Bowen ratio
+                (calc_LE_hat) models, as an alternative to (and a check of) the
+                hand-derived partials (calc_partials, calc_br_partials).
+
+URL:            https://
+
+Requires:       numpy, pandas, aeroet
+
+Dev ToDo:       None
+
+AUTHOR:         Bryn Morgan
+ORGANIZATION:   University of California, Santa Barbara
+Contact:        bryn.morgan@geog.ucsb.edu
+Copyright:      (c) Bryn Morgan 2023
+
+
+"""
+
+
+#-------------------------------------------------------------------------------
+# IMPORTS
+#-------------------------------------------------------------------------------
+import time
+import numpy as np
+import pandas as pd
+
+from aeroet import AirLayer
+
+import utils_sensitivity as sens
+from utils_sensitivity import c_pd, c_pv, EPSILON, R_D, SIGMA, gamma_d
+
+#-------------------------------------------------------------------------------
+#  VARIABLES
+#-------------------------------------------------------------------------------
+# Suffixes used for the partials (matching calc_partials/calc_br_partials keys)
+der_names = {
+    'T_s' : 'Ts', 'r_H' : 'rH', 'T_a' : 'Ta', 'h_r' : 'hr', 'p_a' : 'pa', 'SW_IN' : 'Rsw',
+    'T_a1' : 'Ta1', 'T_a2' : 'Ta2', 'h_r1' : 'hr1', 'h_r2' : 'hr2', 'p_a1' : 'pa1', 'p_a2' : 'pa2',
+}
+
+#-------------------------------------------------------------------------------
+# DUAL NUMBERS
+#-------------------------------------------------------------------------------
+
+class Dual():
+    """
+    Dual number carrying a value and its gradient with respect to k seeded
+    input variables.
+
+    Attributes
+    ----------
+    val : numpy.ndarray
+        Value, shape S.
+    grad : numpy.ndarray
+        Gradient, shape (k, *S).
+    """
+    # Make numpy defer to Dual for mixed ndarray/Dual operations
+    __array_priority__ = 1000
+
+    def __init__(self, val, grad):
+        self.val = val
+        self.grad = grad
+
+    def __repr__(self):
+        return f"Dual(val={self.val!r}, k={len(self.grad)})"
+
+    def __neg__(self):
+        return Dual(-self.val, -self.grad)
+
+    def __add__(self, other):
+        if isinstance(other, Dual):
+            return Dual(self.val + other.val, self.grad + other.grad)
+        return Dual(self.val + other, self.grad)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        if isinstance(other, Dual):
+            return Dual(self.val - other.val, self.grad - other.grad)
+        return Dual(self.val - other, self.grad)
+
+    def __rsub__(self, other):
+        return Dual(other - self.val, -self.grad)
+
+    def __mul__(self, other):
+        if isinstance(other, Dual):
+            return Dual(self.val * other.val, self.grad * other.val + other.grad * self.val)
+        return Dual(self.val * other, self.grad * other)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        if isinstance(other, Dual):
+            val = self.val / other.val
+            return Dual(val, (self.grad - other.grad * val) / other.val)
+        return Dual(self.val / other, self.grad / other)
+
+    def __rtruediv__(self, other):
+        val = other / self.val
+        return Dual(val, -self.grad * (val / self.val))
+
+    def __pow__(self, p):
+        if isinstance(p, Dual):
+            return exp(p * log(self))
+        val = self.val ** p
+        return Dual(val, self.grad * (p * self.val ** (p - 1)))
+
+    def __rpow__(self, base):
+        val = base ** self.val
+        return Dual(val, self.grad * (val * np.log(base)))
+
+
+def exp(x):
+    if isinstance(x, Dual):
+        val = np.exp(x.val)
+        return Dual(val, x.grad * val)
+    return np.exp(x)
+
+def log(x):
+    if isinstance(x, Dual):
+        return Dual(np.log(x.val), x.grad / x.val)
+    return np.log(x)
+
+def value(x):
+    return x.val if isinstance(x, Dual) else x
+
+def seed(wrt, **inputs) -> dict:
+    """
+    Broadcast the inputs to a common shape and seed those named in `wrt` as
+    independent Dual variables (all others are returned as arrays).
+    """
+    names = list(inputs)
+    arrs = np.broadcast_arrays(*[np.asarray(inputs[v], dtype=float) for v in names])
+    out = dict(zip(names, arrs))
+    for i,var in enumerate(wrt):
+        grad = np.zeros((len(wrt),) + out[var].shape)
+        grad[i] = 1.
+        out[var] = Dual(out[var], grad)
+
+    return out
+
+def gradient(x, wrt, prefix='dLE_d', skip=()) -> dict:
+    """
+    Unpack the gradient of `x` into a dict of partials keyed like calc_partials()
+    (omitting the variables in `skip`).
+    """
+    grad = x.grad if isinstance(x, Dual) else np.zeros((len(wrt),) + np.shape(x))
+    return {
+        prefix + der_names.get(v, v) : g for v,g in zip(wrt, grad) if v not in skip
+    }
+
+#-------------------------------------------------------------------------------
+# MODEL (DUAL-COMPATIBLE)
+#-------------------------------------------------------------------------------
+
+def calc_air(T_a, h_r, p_a, z, z_0=0.) -> dict:
+    """
+    AirLayer thermodynamics (e_a, q, rho_a, c_p, lambda_v, theta_a, emissivity)
+    for Dual or array inputs. T_a in K, p_a in kPa, h_r in %.
+    """
+    T_c = T_a - 273.15
+    e_a = (h_r / 100) * (0.611 * exp((17.502 * T_c) / (T_c + 240.97)))
+    q = (EPSILON * e_a) / (p_a - (1 - EPSILON) * e_a)
+
+    air = {
+        'T_a' : T_a,
+        'e_a' : e_a,
+        'q' : q,
+        'rho_a' : ((p_a * 1000) / (R_D * T_a)) * (1 - ((1 - EPSILON) * e_a) / (p_a * 1000)),
+        'c_p' : (1 - q) * c_pd + q * c_pv,
+        'lambda_v' : (2.501 - (2.361e-3 * T_c)) * 1e6,
+        'theta_a' : T_a + (z - z_0) * gamma_d,
+        'emissivity' : 1.24 * ((e_a * 10) / T_a) ** (1. / 7.),
+    }
+    return air
+
+def calc_LE(T_s, r_H, T_a, h_r, SW_IN, p_a, p_s=None, G=None, h=0.3, ndvi=0.98, z=3.8735,
+            wrt=('T_s', 'r_H', 'T_a', 'h_r', 'p_a', 'SW_IN')) -> dict:
+    """
+    Evaluate H and LE (as calc_H()/calc_LE()) and their gradients in one pass.
+
+    Parameters
+    ----------
+    T_s, T_a : float | array-like
+        Surface and air temperatures [°C].
+    r_H : float | array-like
+        Resistance to heat transport [s m-1].
+    h_r : float | array-like
+        Relative humidity [%].
+    SW_IN : float | array-like
+        Incoming shortwave radiation [W m-2].
+    p_a : float | array-like
+        Air pressure [kPa].
+    p_s : float | array-like, optional
+        Surface pressure [kPa], by default p_a (and differentiated as p_a).
+    wrt : tuple, optional
+        Inputs to differentiate with respect to.
+
+    Returns
+    -------
+    out : dict
+        H, LE, R_n and the partials dLE_d<var>, keyed as in calc_partials().
+
+    Notes
+    -----
+    The gradients are exact for the model as implemented: calc_H() uses
+    theta_s = T_s * (100 / p_s)^(R_D / c_pd), and LW_IN = eps_a * sigma * T_a^4
+    as in create_radiation(). If p_s is given, it is held fixed (as in
+    calc_partials()).
+    """
+    surf = sens.create_surface(np.asarray(T_s, dtype=float) + 273.15, ndvi, h)
+    v = seed(wrt, T_s=T_s, r_H=r_H, T_a=T_a, h_r=h_r, SW_IN=SW_IN, p_a=p_a)
+    p_s = v['p_a'] if p_s is None else p_s
+
+    T_s = v['T_s'] + 273.15
+    air = calc_air(v['T_a'] + 273.15, v['h_r'], v['p_a'], z)
+
+    theta_s = T_s * (100. / p_s) ** (R_D / c_pd)
+    H = air['rho_a'] * air['c_p'] * ((theta_s - air['theta_a']) / v['r_H'])
+
+    LW_IN = air['emissivity'] * SIGMA * air['T_a']**4
+    R_n = v['SW_IN'] * (1 - surf.albedo) + LW_IN - surf.epsilon_s * SIGMA * T_s**4
+    LE = R_n - (0.0 if G is None else G) - H
+
+    out = {
+        'H' : value(H),
+        'LE' : value(LE),
+        'R_n' : value(R_n),
+        **gradient(LE, wrt),
+    }
+    return out
+
+def calc_LE_hat(T_s, T_a1, h_r1, p_a1, T_a2, h_r2, p_a2, SW_IN, z1=1.5, z2=60.5, G=None,
+                gamma_i=2, ndvi=0.98, h=0.3,
+                wrt=('T_s', 'T_a1', 'T_a2', 'h_r1', 'h_r2', 'p_a1', 'p_a2', 'SW_IN')) -> dict:
+    """
+    Evaluate beta, LE_hat and H_hat (as run_LE_hat()) and the gradients of
+    LE_hat and beta in one pass.
+
+    Temperatures are in °C, pressures in kPa and relative humidity in %.
+    Returns beta, Q_av, LE, H, the partials dLE_d<var> and dbeta_d<var>.
+    """
+    surf = sens.create_surface(np.asarray(T_s, dtype=float) + 273.15, ndvi, h)
+    v = seed(
+        wrt, T_s=T_s, T_a1=T_a1, h_r1=h_r1, p_a1=p_a1, T_a2=T_a2, h_r2=h_r2,
+        p_a2=p_a2, SW_IN=SW_IN
+    )
+    air1 = calc_air(v['T_a1'] + 273.15, v['h_r1'], v['p_a1'], z1)
+    air2 = calc_air(v['T_a2'] + 273.15, v['h_r2'], v['p_a2'], z2)
+    air_i = air1 if gamma_i == 1 else air2
+
+    beta = (air_i['c_p'] / air_i['lambda_v']) * (
+        (air2['theta_a'] - air1['theta_a']) / (air2['q'] - air1['q'])
+    )
+    Q_av = (
+        v['SW_IN'] * (1 - surf.albedo)
+        + air1['emissivity'] * SIGMA * air1['T_a']**4
+        - surf.epsilon_s * SIGMA * (v['T_s'] + 273.15)**4
+    ) - (0.0 if G is None else G)
+    LE = Q_av / (1 + beta)
+
+    out = {
+        'beta' : value(beta),
+        'Q_av' : value(Q_av),
+        'LE' : value(LE),
+        'H' : value(beta * LE),
+        **gradient(LE, wrt),
+        **gradient(beta, wrt, prefix='dbeta_d', skip=('T_s', 'SW_IN')),
+    }
+    return out
+
+#-------------------------------------------------------------------------------
+# BENCHMARK
+#-------------------------------------------------------------------------------
+
+def compare_partials(n=100_000, rng_seed=0, bowen=False, rtol=1e-7, atol=1e-8) -> pd.DataFrame:
+    """
+    Time the AD and analytic partials on n random states and compare them.
+
+    Both are the exact derivatives of the model as implemented, so they must
+    match to within rtol/atol.
+
+    On 1e5 states the AD pass is about 3-4x slower than the analytic one.
+
+    Parameters
+    ----------
+    n : int, optional
+        Number of random states, by default 100_000.
+    rng_seed : int, optional
+        Seed of the random states, by default 0.
+    bowen : bool, optional
+        Compare the Bowen ratio (LE_hat) partials instead, by default False.
+    rtol, atol : float, optional
+        Tolerances of the check of the AD gradients against the analytic
+        partials.
+
+    Returns
+    -------
+    comp : pandas.DataFrame
+        Maximum absolute and relative differences per partial ('max_abs_diff',
+        'max_rel_diff', 'median_rel_diff'), with the run times [s] of each path
+        in comp.attrs.
+
+    Raises
+    ------
+    AssertionError
+        If the AD gradients differ from the analytic partials by more than the
+        tolerance.
+    """
+    rng = np.random.default_rng(rng_seed)
+    T_s = rng.uniform(5, 50, n)
+    SW_IN = rng.uniform(200, 1000, n)
+
+    if bowen:
+        T_a1, T_a2 = rng.uniform(5, 35, n), rng.uniform(5, 35, n)
+        h_r1, h_r2 = rng.uniform(10, 90, n), rng.uniform(10, 90, n)
+        p_a1, p_a2 = rng.uniform(98, 101, n), rng.uniform(98, 101, n)
+
+        t0 = time.perf_counter()
+        air1 = AirLayer(1.5, 2., T_a1 + 273.15, p_a1, h_r1)
+        air2 = AirLayer(60.5, 2., T_a2 + 273.15, p_a2, h_r2)
+        ref = sens.run_LE_hat(T_s + 273.15, air1, air2, SW_IN, G=0.0)
+        t_ref = time.perf_counter() - t0
+
+        args = (T_s, T_a1, h_r1, p_a1, T_a2, h_r2, p_a2, SW_IN)
+        t0 = time.perf_counter()
+        ad = calc_LE_hat(*args, G=0.0)
+        t_ad = time.perf_counter() - t0
+    else:
+        T_a = rng.uniform(5, 35, n)
+        h_r = rng.uniform(10, 90, n)
+        r_H = rng.uniform(5, 100, n)
+        p_a = rng.uniform(98, 101, n)
+
+        t0 = time.perf_counter()
+        ref = sens.run_LE(T_s, r_H, T_a, h_r, SW_IN, 2., p_a, p_s=p_a)
+        t_ref = time.perf_counter() - t0
+
+        args = (T_s, r_H, T_a, h_r, SW_IN, p_a)
+        t0 = time.perf_counter()
+        ad = calc_LE(*args, p_s=p_a)
+        t_ad = time.perf_counter() - t0
+
+    keys = [key for key in ad if key.startswith('d') and key in ref]
+    for key in keys:
+        np.testing.assert_allclose(ad[key], ref[key], rtol=rtol, atol=atol, err_msg=key)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        comp = pd.DataFrame({
+            key : {
+                'max_abs_diff' : np.nanmax(np.abs(ad[key] - ref[key])),
+                'max_rel_diff' : np.nanmax(np.abs((ad[key] - ref[key]) / ref[key])),
+                'median_rel_diff' : np.nanmedian(np.abs((ad[key] - ref[key]) / ref[key])),
+            } for key in keys
+        }).T
+    comp.attrs = {'t_analytic' : t_ref, 't_ad' : t_ad}
+
+    return comp
@@ -0,0 +1,838 @@
+#!usr/bin/env python
+# -*- coding: utf-8 -*-
+#––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––
+
+__author__ = 'Bryn Morgan'
+__contact__ = 'bryn.morgan@geog.ucsb.edu'
+__copyright__ = '(c) Bryn Morgan 2023'
+
+__license__ = 'MIT'
+__date__ = 'Mon 19 Oct 26 17:05:12'
+__version__ = '1.0'
+__status__ = 'initial release'
+__url__ = ''
+
+"""
+
+Name:           utils_footprint.py
+Compatibility:  Python 3.7.0
+Description:    Flux footprints of the tower for each flight using the Kljun et
+                al. (2015) parameterisation (FFP), with the fp_frac contours of
+                ramajal_fp_stats.csv, footprint weights on the ortho grid and a
+                spatial index over the footprint polygons.
+
+URL:            https://
+
+Requires:       numpy, pandas, contourpy, shapely (FootprintIndex only)
+
+Dev ToDo:       None
+
+AUTHOR:         Bryn Morgan
+ORGANIZATION:   University of California, Santa Barbara
+Contact:        bryn.morgan@geog.ucsb.edu
+Copyright:      (c) Bryn Morgan 2023
+
+
+"""
+
+
+#-------------------------------------------------------------------------------
+# IMPORTS
+#-------------------------------------------------------------------------------
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+import contourpy
+# shapely is only needed for the spatial index (FootprintIndex).
+try:
+    import shapely
+except ImportError:
+    shapely = None
+
+
+#-------------------------------------------------------------------------------
+# VARIABLES
+#-------------------------------------------------------------------------------
+# Tower location (UTM 11N) and measurement height (m)
+tower_coords = (737168.6913608506, 3823582.6557895136)
+z_m = 3.8735
+# Zero-plane displacement height (m)
+d_0 = 0.195
+
+# Footprint fractions (as in ramajal_fp_stats.csv). The fractions halfway
+# between the fp_step contours are the bands between them (see get_bands()).
+fp_fracs = np.round(np.arange(0.10, 0.901, 0.05), 2)
+fp_step = 0.1
+
+# FFP parameters (Kljun et al., 2015)
+ffp_params = {
+    'a' : 1.4524,
+    'b' : -1.9914,
+    'c' : 1.4622,
+    'd' : 0.1359,
+    'ac' : 2.17,
+    'bc' : 1.66,
+    'cc' : 20.0,
+}
+# von Karman constant
+k = 0.4
+# Obukhov length above which conditions are treated as neutral (m)
+ol_n = 5000.
+
+
+#-------------------------------------------------------------------------------
+# INPUTS
+#-------------------------------------------------------------------------------
+
+def calc_blh(ustar, L, lat=34., h_conv=1000.):
+    """
+    Boundary-layer height (m). Under stable conditions this is the
+    equilibrium height of Nieuwstadt (1981). The convective boundary layer is
+    not diagnosable from a single half-hour, so h_conv is used for L < 0.
+
+    Parameters
+    ----------
+    ustar : array-like
+        Friction velocity (m s-1).
+    L : array-like
+        Obukhov length (m).
+    lat : float, optional
+        Latitude (degrees). The default is 34.
+    h_conv : float, optional
+        Height of the convective boundary layer (m). The default is 1000.
+    """
+    ustar = np.asarray(ustar, dtype=float)
+    L = np.asarray(L, dtype=float)
+    f_c = 2 * 7.2921e-5 * np.sin(np.deg2rad(lat))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        h_stab = L / 3.8 * (-1 + np.sqrt(1 + 2.28 * ustar / (f_c * L)))
+
+    return np.where((L > 0) & (L < ol_n), h_stab, h_conv)
+
+
+def get_ffp_inputs(tower, z=z_m, d_0=d_0, h=None, z_0=None, lat=34., h_conv=1000.) -> pd.DataFrame:
+    """
+    FFP inputs of each flight from the tower data (tower_all.csv).
+
+    Parameters
+    ----------
+    tower : pandas.DataFrame
+        Tower data (ustar, L, wind_dir, v_var, u), indexed by (or with a column)
+        FlightDateTime.
+    z : float, optional
+        Measurement height (m).
+    d_0 : float, optional
+        Zero-plane displacement height (m).
+    h : float or array-like, optional
+        Boundary-layer height (m). The default (None) uses calc_blh().
+    z_0 : float, optional
+        Roughness length (m). If None (default), the mean wind speed u is used
+        instead (as recommended by Kljun et al. when z_0 is uncertain).
+
+    Returns
+    -------
+    inp : pandas.DataFrame
+        zm, ustar, ol, sigmav, umean, wind_dir, h (and z0), plus a boolean
+        'valid' column flagging conditions within the range of the FFP.
+    """
+    if 'FlightDateTime' in tower.columns:
+        tower = tower.set_index('FlightDateTime')
+
+    inp = pd.DataFrame({
+        'zm' : z - d_0,
+        'ustar' : tower['ustar'],
+        'ol' : tower['L'],
+        'sigmav' : np.sqrt(tower['v_var']),
+        'umean' : tower['u'],
+        'wind_dir' : tower['wind_dir'],
+    }, index=tower.index)
+    inp['h'] = calc_blh(inp.ustar, inp.ol, lat=lat, h_conv=h_conv) if h is None else h
+    if z_0 is not None:
+        inp['z0'] = z_0
+    inp['valid'] = check_ffp_inputs(inp)
+
+    return inp
+
+
+def check_ffp_inputs(inp : pd.DataFrame) -> pd.Series:
+    """
+    Flag the flights for which the FFP is valid (Kljun et al., 2015):
+    u* >= 0.1 m s-1, zm / L >= -15.5, zm < h (and h > 10 m), and sigma_v > 0.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        valid = (
+            (inp.ustar >= 0.1) & (inp.zm / inp.ol >= -15.5) &
+            (inp.h > 10.) & (inp.zm < inp.h) & (inp.sigmav > 0.) &
+            inp.wind_dir.between(0., 360.)
+        )
+    if 'z0' in inp:
+        valid &= (inp.z0 > 0.) & (inp.zm > 12.5 * inp.z0)
+    else:
+        valid &= inp.umean > 0.
+
+    return valid
+
+
+#-------------------------------------------------------------------------------
+# FOOTPRINT
+#-------------------------------------------------------------------------------
+
+def calc_psi_f(zm, ol):
+    """
+    Stability correction of the wind profile used by the FFP.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        xx = (1 - 19.0 * zm / ol) ** 0.25
+        psi_u = np.log((1 + xx**2) / 2.) + 2. * np.log((1 + xx) / 2.) - 2. * np.arctan(xx) + np.pi / 2
+        psi_s = -5.3 * zm / ol
+
+    return np.where((ol > 0) & (ol < ol_n), psi_s, psi_u)
+
+
+def calc_xstar_scale(zm, ustar, ol, h, umean=None, z0=None):
+    """
+    Scale between the along-wind distance and the dimensionless distance of the
+    FFP (x* = x * scale). It is also the scale of the crosswind-integrated
+    footprint (f_ci = f* * scale).
+    """
+    if z0 is None:
+        s = umean / ustar * k
+    else:
+        s = np.log(zm / z0) - calc_psi_f(zm, ol)
+
+    return (1 - zm / h) / (zm * s)
+
+
+def calc_xpeak(zm, ustar, ol, h, umean=None, z0=None):
+    """
+    Along-wind distance of the peak of the footprint from the tower (m).
+    """
+    p = ffp_params
+    ol = np.where(ol > ol_n, -1e6, ol)
+
+    return (p['d'] - p['c'] / p['b']) / calc_xstar_scale(zm, ustar, ol, h, umean=umean, z0=z0)
+
+
+def calc_ffp_ci(x, zm, ustar, ol, sigmav, h, umean=None, z0=None):
+    """
+    Crosswind-integrated footprint and crosswind dispersion of the FFP at an
+    along-wind (upwind) distance x from the tower. All inputs broadcast.
+
+    Returns
+    -------
+    f_ci : numpy.ndarray
+        Crosswind-integrated footprint (m-1).
+    sigma_y : numpy.ndarray
+        Crosswind standard deviation of the footprint (m).
+    """
+    p = ffp_params
+    ol = np.where(ol > ol_n, -1e6, ol)
+    scale = calc_xstar_scale(zm, ustar, ol, h, umean=umean, z0=z0)
+    xstar = np.asarray(x) * scale
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        xd = xstar - p['d']
+        fstar = np.where(xd > 0, p['a'] * xd**p['b'] * np.exp(-p['c'] / xd), 0.)
+        sigystar = p['ac'] * np.sqrt(p['bc'] * xstar**2 / (1 + p['cc'] * np.abs(xstar)))
+        scale_const = np.minimum(1e-5 * np.abs(zm / ol)**-1 + np.where(ol <= 0, 0.80, 0.55), 1.)
+        sigma_y = sigystar / scale_const * zm * sigmav / ustar
+
+    return fstar * scale, sigma_y
+
+
+def calc_ffp(dx, dy, zm, ustar, ol, sigmav, h, wind_dir, umean=None, z0=None):
+    """
+    2-D footprint of the FFP (m-2) at east/north offsets dx, dy (m) from the
+    tower. All inputs broadcast, so a stack of flights is evaluated at once by
+    passing the flight inputs with shape (n, 1, 1).
+    """
+    wd = np.deg2rad(wind_dir)
+    x = dx * np.sin(wd) + dy * np.cos(wd)
+    y = dx * np.cos(wd) - dy * np.sin(wd)
+
+    f_ci, sigma_y = calc_ffp_ci(x, zm, ustar, ol, sigmav, h, umean=umean, z0=z0)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        f = f_ci / (np.sqrt(2 * np.pi) * sigma_y) * np.exp(-y**2 / (2 * sigma_y**2))
+
+    return np.where(f_ci > 0, f, 0.)
+
+
+def _get_params(inp : pd.DataFrame, ndim=3) -> dict:
+    """
+    FFP inputs of a stack of flights as arrays broadcastable against a grid.
+    """
+    shape = (-1,) + (1,) * (ndim - 1)
+    cols = ['zm', 'ustar', 'ol', 'sigmav', 'h', 'wind_dir']
+    cols += ['z0'] if 'z0' in inp else ['umean']
+
+    return {col : inp[col].to_numpy(dtype=float).reshape(shape) for col in cols}
+
+
+def calc_ffp_grids(inp : pd.DataFrame, res=0.5, extent=250., chunk_size=4):
+    """
+    Footprints of all flights on a common grid centred on the tower.
+
+    Parameters
+    ----------
+    inp : pandas.DataFrame
+        FFP inputs (get_ffp_inputs()).
+    res : float, optional
+        Grid resolution (m). The default is 0.5.
+    extent : float, optional
+        Half-width of the grid (m). The default is 250.
+    chunk_size : int, optional
+        Number of flights evaluated together (bounds the memory of the
+        intermediate arrays). The default is 4.
+
+    Returns
+    -------
+    x, y : numpy.ndarray
+        East and north offsets from the tower of the grid cell centres (m).
+    f : numpy.ndarray
+        (n_flights, y, x) footprints (m-2). Flights outside the range of the FFP
+        are NaN.
+    """
+    x = np.arange(-extent, extent + res / 2, res)
+    y = x.copy()
+    dx, dy = np.meshgrid(x, y)
+
+    valid = inp['valid'].to_numpy() if 'valid' in inp else np.ones(len(inp), dtype=bool)
+    f = np.full((len(inp), len(y), len(x)), np.nan)
+    for i in range(0, len(inp), chunk_size):
+        sl = slice(i, i + chunk_size)
+        params = _get_params(inp.iloc[sl])
+        f[sl] = calc_ffp(
+            dx, dy, params['zm'], params['ustar'], params['ol'], params['sigmav'],
+            params['h'], params['wind_dir'], umean=params.get('umean'), z0=params.get('z0')
+        )
+    f[~valid] = np.nan
+
+    return x, y, f
+
+
+#-------------------------------------------------------------------------------
+# CONTOURS
+#-------------------------------------------------------------------------------
+
+def calc_contour_levels(f, dA, fracs=fp_fracs) -> np.ndarray:
+    """
+    Footprint values of the contours enclosing each fraction of the footprint
+    (i.e. the smallest areas containing those fractions of the flux).
+
+    Parameters
+    ----------
+    f : numpy.ndarray
+        (n_flights, y, x) footprints.
+    dA : float
+        Area of a grid cell (m2).
+    fracs : array-like, optional
+        Footprint fractions. The default is fp_fracs.
+
+    Returns
+    -------
+    levels : numpy.ndarray
+        (n_flights, n_fracs) contour levels. NaN where the fraction is not
+        contained in the grid.
+    """
+    fracs = np.asarray(fracs, dtype=float)
+    levels = np.full((len(f), len(fracs)), np.nan)
+    for i, fi in enumerate(f):
+        if not np.isfinite(fi).all():
+            continue
+        sf = np.sort(fi, axis=None)[::-1]
+        cum = np.cumsum(sf) * dA
+        j = np.searchsorted(cum, fracs)
+        inside = j < len(sf)
+        levels[i, inside] = sf[j[inside]]
+
+    return levels
+
+
+def get_bands(fracs=fp_fracs, step=fp_step) -> np.ndarray:
+    """
+    Outer and inner footprint fractions of the geometry of each fp_frac. As in
+    ramajal_fp_stats.csv, a fraction halfway between two multiples of step is
+    the band between those contours (e.g. 0.15 is the 0.2 contour with the 0.1
+    contour as a hole); any other fraction is a filled contour.
+
+    Returns
+    -------
+    bands : numpy.ndarray
+        (n_fracs, 2) outer and inner fractions. The inner fraction is NaN for
+        the filled contours.
+    """
+    fracs = np.asarray(fracs, dtype=float)
+    n = fracs / step
+    band = np.isclose(n - np.floor(n), 0.5)
+    outer = np.where(band, fracs + step / 2, fracs)
+    inner = np.where(band, fracs - step / 2, np.nan)
+
+    return np.round(np.stack([outer, inner], axis=-1), 10)
+
+
+def _ring_area(xy):
+    """
+    Area of a closed ring (shoelace formula).
+    """
+    x, y = xy[:, 0], xy[:, 1]
+
+    return 0.5 * np.abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+
+
+def get_contours(x, y, f, levels) -> list:
+    """
+    Contours of one footprint at all levels, traced in one pass.
+
+    Returns
+    -------
+    contours : list
+        (n, 2) array of vertices (offsets from the tower) of each level, or None
+        if the level is NaN or the contour is not closed within the grid.
+    """
+    levels = np.asarray(levels, dtype=float)
+    contours = [None] * len(levels)
+    finite = np.flatnonzero(np.isfinite(levels))
+    if not len(finite):
+        return contours
+
+    gen = contourpy.contour_generator(x, y, f, line_type='Separate')
+    for i, lines in zip(finite, gen.multi_lines(levels[finite])):
+        if not lines or any(not np.allclose(ln[0], ln[-1]) for ln in lines):
+            continue
+        contours[i] = max(lines, key=_ring_area)
+
+    return contours
+
+
+def to_wkt(xy, hole=None) -> str:
+    """
+    WKT polygon of a ring of vertices, optionally with a hole (as in
+    ramajal_fp_stats.csv).
+    """
+    if xy is None:
+        return None
+    rings = [xy] if hole is None else [xy, hole]
+    coords = [
+        ', '.join(f"{x!r} {y!r}" for x, y in np.asarray(ring, dtype=float).tolist())
+        for ring in rings
+    ]
+
+    return "POLYGON (" + ', '.join(f"({c})" for c in coords) + ")"
+
+
+def get_geometries(x, y, f, dA, bands, tower_coords=tower_coords) -> tuple:
+    """
+    WKT geometries (contours or bands, see get_bands()) of one footprint.
+
+    Returns
+    -------
+    geoms : list
+        WKT of each band, or None if one of its contours is not closed within
+        the grid.
+    levels : numpy.ndarray
+        (n_fracs, 2) contour levels of the outer and inner fractions.
+    """
+    lev_fracs = np.unique(bands[np.isfinite(bands)])
+    lev = calc_contour_levels(f[None], dA, fracs=lev_fracs)[0]
+    rings = dict(zip(lev_fracs, get_contours(x, y, f, lev)))
+
+    levels = np.full(bands.shape, np.nan)
+    geoms = []
+    for i, (outer, inner) in enumerate(bands):
+        levels[i, 0] = lev[np.searchsorted(lev_fracs, outer)]
+        xy = rings[outer]
+        if np.isnan(inner):
+            hole = None
+        else:
+            levels[i, 1] = lev[np.searchsorted(lev_fracs, inner)]
+            hole = rings[inner]
+            if hole is None:
+                xy = None
+        geoms.append(to_wkt(
+            None if xy is None else xy + tower_coords,
+            None if hole is None else hole + tower_coords
+        ))
+
+    return geoms, levels
+
+
+#-------------------------------------------------------------------------------
+# FOOTPRINTS OF EACH FLIGHT
+#-------------------------------------------------------------------------------
+
+# Footprints of each flight (see get_footprints())
+_ffp_cache = {}
+# FFP inputs stored with each cached footprint
+ffp_cols = ['zm', 'ustar', 'ol', 'sigmav', 'umean', 'wind_dir', 'h', 'z0']
+
+def _get_inputs(inp : pd.DataFrame) -> np.ndarray:
+    """
+    (n_flights, n_cols) array of the ffp_cols of each flight (z0 is NaN when the
+    mean wind speed is used).
+    """
+    return inp.reindex(columns=ffp_cols).to_numpy(dtype=float)
+
+
+def _is_current(fp : dict, fracs, res, extent, inputs, tower_coords) -> bool:
+    """
+    Whether a cached footprint was computed with the same settings, FFP inputs
+    and tower coordinates.
+    """
+    return (
+        'inputs' in fp and 'tower_coords' in fp and 'bands' in fp and
+        np.array_equal(fp['fracs'], fracs) and
+        np.array_equal(fp['bands'], get_bands(fracs), equal_nan=True) and
+        np.isclose(fp['res'], res) and np.isclose(fp['extent'], extent) and
+        np.array_equal(fp['inputs'], inputs, equal_nan=True) and
+        np.array_equal(fp['tower_coords'], np.asarray(tower_coords, dtype=float))
+    )
+
+
+def _save_footprint(file, fp : dict):
+    wkt = np.array(['' if g is None else g for g in fp['contours']])
+    np.savez(
+        file, x=fp['x'], y=fp['y'], f=fp['f'], fracs=fp['fracs'], bands=fp['bands'], levels=fp['levels'],
+        contours=wkt, res=fp['res'], extent=fp['extent'], inputs=fp['inputs'],
+        tower_coords=fp['tower_coords']
+    )
+
+
+def _load_footprint(file) -> dict:
+    with np.load(file) as npz:
+        fp = {key : npz[key] for key in npz.files}
+    fp['res'] = fp['res'].item()
+    fp['extent'] = fp['extent'].item()
+    fp['contours'] = [g if g else None for g in fp['contours'].tolist()]
+
+    return fp
+
+
+def get_footprints(
+    tower, fracs=fp_fracs, res=0.5, extent=250., tower_coords=tower_coords,
+    cache_dir=None, chunk_size=4, **kwargs
+) -> dict:
+    """
+    Footprints and fp_frac contours of each flight, cached in memory and
+    (optionally) on disk as '<cache_dir>/ffp_<flight>.npz'. A cached footprint
+    is reused only if its grid, fracs, FFP inputs (get_ffp_inputs()) and tower
+    coordinates are unchanged; the flights not cached are evaluated together
+    on a common grid.
+
+    Parameters
+    ----------
+    tower : pandas.DataFrame
+        Tower data (see get_ffp_inputs()).
+    fracs : array-like, optional
+        Footprint fractions of the geometries (contours or bands, see
+        get_bands()). The default is fp_fracs.
+    res, extent : float, optional
+        Resolution and half-width of the footprint grid (m).
+    tower_coords : tuple, optional
+        (x, y) coordinates of the tower, used for the contour geometries.
+    cache_dir : str, optional
+        Directory of the on-disk cache. The default (None) caches in memory only.
+    **kwargs
+        Passed to get_ffp_inputs().
+
+    Returns
+    -------
+    fps : dict
+        For each flight (str(FlightDateTime)), a dict of the grid offsets (x, y),
+        footprint (f), fracs, bands, contour levels of the bands, geometries
+        (WKT), and the FFP inputs and tower coordinates they were computed with.
+    """
+    fracs = np.asarray(fracs, dtype=float)
+    inp = get_ffp_inputs(tower, **kwargs)
+    flights = [str(fl) for fl in inp.index]
+    inputs = dict(zip(flights, _get_inputs(inp)))
+    tower_coords = np.asarray(tower_coords, dtype=float)
+
+    fps = {}
+    todo = []
+    for flight in flights:
+        file = None if cache_dir is None else os.path.join(cache_dir, f"ffp_{flight}.npz")
+        args = (fracs, res, extent, inputs[flight], tower_coords)
+        fp = _ffp_cache.get(flight)
+        if (fp is None or not _is_current(fp, *args)) and file is not None and os.path.isfile(file):
+            fp = _load_footprint(file)
+        if fp is not None and _is_current(fp, *args):
+            fps[flight] = _ffp_cache[flight] = fp
+        else:
+            todo.append(flight)
+
+    if todo:
+        idx = [flights.index(fl) for fl in todo]
+        x, y, f = calc_ffp_grids(inp.iloc[idx], res=res, extent=extent, chunk_size=chunk_size)
+        params = _get_params(inp.iloc[idx], ndim=1)
+        x_peak = calc_xpeak(
+            params['zm'], params['ustar'], params['ol'], params['h'],
+            umean=params.get('umean'), z0=params.get('z0')
+        )
+        bands = get_bands(fracs)
+        for flight, f_i, xp in zip(todo, f, x_peak):
+            if not np.isfinite(f_i).all():
+                warnings.warn(f"Inputs of flight {flight} are outside the range of the FFP.")
+            elif xp < 4 * res:
+                warnings.warn(
+                    f"The footprint of flight {flight} peaks {xp:.2f} m from the tower, "
+                    f"which a {res} m grid does not resolve; its contours are too small."
+                )
+            contours, levels = get_geometries(x, y, f_i, res**2, bands, tower_coords=tower_coords)
+            fp = {
+                'x' : x, 'y' : y, 'f' : f_i, 'fracs' : fracs, 'bands' : bands,
+                'levels' : levels, 'contours' : contours, 'res' : res, 'extent' : extent,
+                'inputs' : inputs[flight], 'tower_coords' : tower_coords
+            }
+            if cache_dir is not None:
+                _save_footprint(os.path.join(cache_dir, f"ffp_{flight}.npz"), fp)
+            fps[flight] = _ffp_cache[flight] = fp
+
+    return {flight : fps[flight] for flight in flights}
+
+
+def calc_fp_contours(tower, fracs=fp_fracs, **kwargs) -> pd.DataFrame:
+    """
+    fp_frac geometries of each flight as a long table (FlightDateTime, fp_frac,
+    geometry), in the format of ramajal_fp_stats.csv: filled contours at the
+    multiples of fp_step, and the bands between them at the fractions halfway
+    (see get_bands()). A footprint that peaks within a few grid cells of the
+    tower is not resolved by the grid (see get_footprints(), which warns), so
+    pass a finer res for such flights.
+    """
+    fps = get_footprints(tower, fracs=fracs, **kwargs)
+    inp_index = tower['FlightDateTime'] if 'FlightDateTime' in tower.columns else tower.index
+
+    rows = [
+        {'FlightDateTime' : dt, 'fp_frac' : frac, 'geometry' : geom}
+        for dt, fp in zip(inp_index, fps.values())
+        for frac, geom in zip(fp['fracs'], fp['contours'])
+    ]
+
+    return pd.DataFrame(rows)
+
+
+def calc_fp_weights(tower_row, x, y, tower_coords=tower_coords, **kwargs) -> np.ndarray:
+    """
+    Footprint weights of one flight on a pixel grid (e.g. of the ortho), for use
+    with utils_tiles.FootprintWeights.from_grid(). The footprint is evaluated at
+    the pixel centres and multiplied by the pixel area, so the weights sum to
+    the fraction of the footprint covered by the grid.
+
+    Parameters
+    ----------
+    tower_row : pandas.Series
+        Tower data of the flight (a row of tower_all.csv).
+    x, y : array-like
+        Coordinates of the pixel centres (e.g. ortho_array.x, ortho_array.y).
+    **kwargs
+        Passed to get_ffp_inputs().
+
+    Returns
+    -------
+    weights : numpy.ndarray
+        (y, x) footprint weights.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    inp = get_ffp_inputs(tower_row.to_frame().T.infer_objects(), **kwargs)
+    if not inp['valid'].iloc[0]:
+        raise ValueError(f"Inputs of flight {inp.index[0]} are outside the range of the FFP.")
+
+    params = {key : val.item() for key, val in _get_params(inp, ndim=1).items()}
+    dx, dy = np.meshgrid(x - tower_coords[0], y - tower_coords[1])
+    f = calc_ffp(
+        dx, dy, params['zm'], params['ustar'], params['ol'], params['sigmav'],
+        params['h'], params['wind_dir'], umean=params.get('umean'), z0=params.get('z0')
+    )
+    dA = np.abs(np.diff(x).mean() * np.diff(y).mean())
+
+    return f * dA
+
+
+#-------------------------------------------------------------------------------
+# SPATIAL INDEX
+#-------------------------------------------------------------------------------
+
+class FootprintIndex():
+    """
+    Spatial index over the footprint polygons of all flights, models and
+    fp_fracs (e.g. ramajal_fp_stats.csv). The WKT is parsed once into a packed
+    STRtree, so point and geometry queries against every footprint are single
+    bulk tree queries.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Footprint table with a WKT geometry column (rows without a geometry
+        are dropped).
+    geom_col : str, optional
+        Name of the geometry column. The default is 'geometry'.
+    node_capacity : int, optional
+        Node capacity of the STRtree. The default is 10.
+
+    Attributes
+    ----------
+    geoms : numpy.ndarray
+        Footprint polygons.
+    meta : pandas.DataFrame
+        The remaining columns (Flight, FlightDateTime, Model, fp_frac, ...) of
+        each footprint, aligned with geoms.
+    tree : shapely.STRtree
+    """
+    def __init__(self, df : pd.DataFrame, geom_col='geometry', node_capacity=10):
+        if shapely is None:
+            raise ImportError("FootprintIndex requires shapely (>= 2.0).")
+        df = df.dropna(subset=[geom_col]).reset_index(drop=True)
+        self.geoms = shapely.from_wkt(df[geom_col].to_numpy(dtype=object))
+        self.meta = df.drop(columns=geom_col)
+        self.tree = shapely.STRtree(self.geoms, node_capacity=node_capacity)
+
+    def __repr__(self):
+        return f"FootprintIndex(n_geoms={len(self.geoms)})"
+
+    def __len__(self):
+        return len(self.geoms)
+
+    @classmethod
+    def from_file(cls, file='ramajal_fp_stats.csv', dt_cols=['Flight', 'FlightDateTime'], **kwargs):
+        """
+        Create from a footprint table in the results folder (see utils.read_results()).
+        """
+        # utils (pytz, timezonefinder) is only needed to read the results tables.
+        import utils
+        return cls(utils.read_results(file, dt_cols=dt_cols), **kwargs)
+
+    def select(self, **kwargs) -> np.ndarray:
+        """
+        Boolean mask of the footprints matching the given column values, e.g.
+        select(fp_frac=0.8, Model='Brutsaert'). A list of values matches any of
+        them, and fp_frac is compared to within floating-point tolerance.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for col, val in kwargs.items():
+            if val is None:
+                continue
+            vals = np.atleast_1d(val)
+            if col == 'fp_frac':
+                mask &= np.isclose(self.meta[col].to_numpy()[:, None], vals[None, :]).any(axis=1)
+            else:
+                mask &= self.meta[col].isin(vals).to_numpy()
+
+        return mask
+
+    def _to_frame(self, pairs, **kwargs) -> pd.DataFrame:
+        """
+        Table of (input, footprint) pairs of a tree query, restricted to the
+        footprints matching kwargs (see select()).
+        """
+        inp_idx, fp_idx = pairs
+        keep = self.select(**kwargs)[fp_idx]
+        inp_idx, fp_idx = inp_idx[keep], fp_idx[keep]
+
+        out = self.meta.iloc[fp_idx].reset_index(drop=True)
+        out.insert(0, 'fp_idx', fp_idx)
+        out.insert(0, 'idx', inp_idx)
+
+        return out
+
+    def query_points(self, x, y, **kwargs) -> pd.DataFrame:
+        """
+        Footprints containing each of a set of points (e.g. pixel centres or
+        plot locations).
+
+        Parameters
+        ----------
+        x, y : array-like
+            Point coordinates (UTM).
+        **kwargs
+            Footprint selection (see select()), e.g. fp_frac=0.8.
+
+        Returns
+        -------
+        hits : pandas.DataFrame
+            One row per (point, footprint) pair: the index of the point (idx),
+            the index of the footprint (fp_idx) and the footprint's columns.
+        """
+        pts = shapely.points(np.ravel(x), np.ravel(y))
+
+        return self._to_frame(self.tree.query(pts, predicate='within'), **kwargs)
+
+    def query_geoms(self, geoms, predicate='intersects', area=False, **kwargs) -> pd.DataFrame:
+        """
+        Footprints related to a set of geometries (e.g. plots) by a spatial
+        predicate.
+
+        Parameters
+        ----------
+        geoms : array-like
+            Shapely geometries or WKT strings.
+        predicate : str, optional
+            STRtree predicate, tested as predicate(geom, footprint). The default
+            is 'intersects'.
+        area : bool, optional
+            Also return the area of each intersection (m2) and its fraction of
+            the area of the geometry. The default is False.
+        **kwargs
+            Footprint selection (see select()).
+
+        Returns
+        -------
+        hits : pandas.DataFrame
+            As for query_points(), with 'area' and 'area_frac' if area=True.
+        """
+        geoms = np.atleast_1d(np.asarray(geoms, dtype=object))
+        if len(geoms) and isinstance(geoms[0], str):
+            geoms = shapely.from_wkt(geoms)
+
+        hits = self._to_frame(self.tree.query(geoms, predicate=predicate), **kwargs)
+        if area:
+            inter = shapely.intersection(geoms[hits['idx']], self.geoms[hits['fp_idx']])
+            hits['area'] = shapely.area(inter)
+            hits['area_frac'] = hits['area'] / shapely.area(geoms[hits['idx']])
+
+        return hits
+
+    def coverage(self, x, y, by='Flight', **kwargs) -> pd.DataFrame:
+        """
+        Which footprints cover which points, as a boolean (point x group) table,
+        e.g. coverage(x, y, fp_frac=0.8) for the flights whose 80% footprint
+        covers each pixel.
+        """
+        n = np.size(x)
+        hits = self.query_points(x, y, **kwargs)
+        cov = pd.crosstab(hits['idx'], hits[by]).gt(0)
+
+        return cov.reindex(index=range(n), fill_value=False)
+
+    def mask(self, i, x, y) -> np.ndarray:
+        """
+        Boolean (y, x) mask of the pixels of a grid within footprint i.
+
+        Parameters
+        ----------
+        i : int
+            Index of the footprint (fp_idx).
+        x, y : array-like
+            Coordinates of the pixel centres (e.g. ortho_array.x, ortho_array.y).
+        """
+        geom = self.geoms[i]
+        shapely.prepare(geom)
+        xx, yy = np.meshgrid(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+
+        return shapely.contains_xy(geom, xx, yy)
+
+
+# Footprint indices of each footprint table (see get_fp_index())
+_index_cache = {}
+
+def get_fp_index(file='ramajal_fp_stats.csv', **kwargs) -> FootprintIndex:
+    """
+    Get the FootprintIndex of a footprint table, parsed once and cached in
+    memory.
+    """
+    if file not in _index_cache:
+        _index_cache[file] = FootprintIndex.from_file(file, **kwargs)
+
+    return _index_cache[file]
@@ -0,0 +1,1463 @@
+#!usr/bin/env python
+# -*- coding: utf-8 -*-
+#––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––
+
+__author__ = 'Bryn Morgan'
+__contact__ = 'bryn.morgan@geog.ucsb.edu'
+__copyright__ = '(c) Bryn Morgan 2023'
+
+__license__ = 'MIT'
+__date__ = 'Mon 19 Oct 26 16:12:40'
+__version__ = '1.0'
+__status__ = 'initial release'
+__url__ = ''
+
+"""
+
+Name:           utils_tiles.py
+Compatibility:  Python 3.7.0
+Description:    Tiled (windowed) runs of the aeroet flux models over full
+                MicaSense orthos, writing the output rasters to disk tile by
+                tile so that scene size is not limited by memory.
+
+URL:            https://
+
+Requires:       numpy, xarray, rioxarray, rasterio, aeroet
+
+Dev ToDo:       None
+
+AUTHOR:         Bryn Morgan
+ORGANIZATION:   University of California, Santa Barbara
+Contact:        bryn.morgan@geog.ucsb.edu
+Copyright:      (c) Bryn Morgan 2023
+
+
+"""
+
+
+#-------------------------------------------------------------------------------
+# IMPORTS
+#-------------------------------------------------------------------------------
+import os
+import sys
+
+import copy
+import io
+import time
+from contextlib import redirect_stdout
+from concurrent import futures
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+import xarray as xr
+import rioxarray as rio
+import rasterio
+from rasterio.windows import Window
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+if not any('aeroet' in x for x in sys.path):
+    sys.path.append('/Users/brynmorgan/dev/aeroet/src/')
+
+from aeroet import AirLayer, Surface, Radiation
+from aeroet import radiation, model
+
+from ortho import MicaSenseOrtho
+from utils_uncertainty import StreamStats
+
+#-------------------------------------------------------------------------------
+#  VARIABLES
+#-------------------------------------------------------------------------------
+# AirLayer variables in the UAV met table (suffixed with _1/_2 for each level)
+air_vars = ['z','u','T_a','h_r','p_a']
+
+# Flux models (as in ramajal_models.csv)
+model_classes = {
+    'Neutral' : model.NeutralModel,
+    'Dyer' : model.DyerModel,
+    'Brutsaert' : model.BrutsaertModel,
+    'Bowen' : model.BowenModel,
+}
+# Model output variables (FluxModel.get_fluxes())
+flux_vars = ['zeta','u_star','Psi_M','Psi_H','r_aH','r_bH','r_H','L','H','LE','ET','EF']
+
+# Summary statistics of each model variable (as in ramajal_models.csv)
+sum_stats = ['MEAN','MAX','MIN','MEDIAN','STD','SRC_WT_MEAN']
+# Histogram bin edges used for the MEDIAN of each per-pixel variable
+flux_bins = {
+    'LE' : np.linspace(-1000., 2000., 30001),           # 0.1 W m-2
+    'H' : np.linspace(-1000., 2000., 30001),
+    'r_bH' : np.linspace(0., 500., 50001),              # 0.01 s m-1
+    'r_H' : np.linspace(-500., 1000., 150001),
+    'ET' : np.linspace(-1.5, 3., 45001),                # 1e-4 mm h-1
+    'EF' : np.linspace(-5., 5., 100001),                # 1e-4
+}
+
+# Outputs of the per-pixel stability iteration
+stab_vars = ['zeta','Psi_M','Psi_H','u_star','r_aH','r_bH','r_H','H','LE','L']
+# Per-pixel inputs of the stability iteration
+stab_inputs = {
+    'surface' : ['theta_s','lai','d_0','z_0m','z_0h','h','w_l'],
+    'radiation' : ['R_n','G'],
+}
+
+# Soil heat flux parameters (t is the local hour of the flight)
+G_params = {
+    'A' : 0.17860959,
+    'c' : -4.14198702,
+    't' : 12.123472222222222,
+}
+
+#-------------------------------------------------------------------------------
+# SURFACE SUBCLASS
+#-------------------------------------------------------------------------------
+
+class TileSurface(Surface):
+    """
+    Surface for one tile of a scene.
+
+    Surface.calc_lai() scales NDVI by its scene minimum/maximum, so a tile on its
+    own would get a different LAI (and r_bH) than the same pixels in the full
+    scene. vi_range fixes the scaling to the scene values.
+    """
+    def __init__(self, *args, vi_range=None, **kwargs):
+
+        self.vi_range = vi_range
+
+        super().__init__(*args, **kwargs)
+
+    def calc_vi_scaled(self):
+
+        if self.vi_range is None:
+            return super().calc_vi_scaled()
+
+        vi_soil, vi_veg = self.vi_range
+
+        vi_star = (self.ndvi - vi_soil) / (vi_veg - vi_soil)
+
+        vi_star = xr.where(vi_star == 1.0, vi_veg, vi_star)
+        vi_star = xr.where(vi_star < 0.0, 0.0, vi_star)
+
+        return vi_star
+
+#-------------------------------------------------------------------------------
+# SCENE INPUTS
+#-------------------------------------------------------------------------------
+
+def create_airlayers(met, h=0.3, air_vars=air_vars):
+    """
+    Create the AirLayers at both measurement levels from one row of the UAV
+    met table (e.g. ramajal_met.csv).
+
+    Parameters
+    ----------
+    met : pandas.Series or dict
+        Met data for one flight, with columns air_vars suffixed by '_1' (lower
+        level) and '_2' (upper level).
+    h : float, optional
+        Canopy height [m], used as z_0. The default is 0.3.
+
+    Returns
+    -------
+    air1, air2 : AirLayer
+        Lower and upper air layers.
+    """
+    air1 = AirLayer(**{var : met[var + '_1'] for var in air_vars}, z_0=h)
+    air2 = AirLayer(**{var : met[var + '_2'] for var in air_vars}, z_0=h)
+
+    return air1, air2
+
+
+def calc_scene_terms(air1 : AirLayer, air2 : AirLayer, h=0.3) -> dict:
+    """
+    Calculate the radiation/temperature-correction terms that depend only on the
+    (scalar) air layers, so they are computed once per scene rather than per
+    pixel or per tile.
+
+    Returns
+    -------
+    terms : dict
+        'LW_sky1', 'LW_sky2' : incoming longwave from each air layer (before
+        surface emissivity) [W m-2]
+        'T_a' : air temperature used to correct the brightness temperature [K]
+        'tau' : atmospheric transmissivity between the surface and the UAV.
+    """
+    terms = {
+        'LW_sky1' : radiation.calc_LW(air1.T_a, air1.calc_emissivity()),
+        'LW_sky2' : radiation.calc_LW(air2.T_a, air2.calc_emissivity()),
+        'T_a' : air2.T_a,
+        'tau' : air2.calc_tau(wvc=air2.calc_wvc(), d=air2.z - h),
+    }
+    return terms
+
+
+def get_tile_inputs(tile, nodata=65535.):
+    """
+    Get LST and NDVI from a tile of a MicaSense ortho.
+
+    Parameters
+    ----------
+    tile : xarray.DataArray
+        (band, y, x) window of the ortho.
+    nodata : float, optional
+        NoData value to mask if the raster does not encode one. The default is
+        65535.
+
+    Returns
+    -------
+    T_s, ndvi : xarray.DataArray
+        Surface (brightness) temperature [K] and NDVI of the tile.
+    """
+    tile = tile.where(tile != nodata)
+
+    T_s = tile[MicaSenseOrtho.bands.get('TIR')] / 100
+
+    red = tile[MicaSenseOrtho.bands.get('R')]
+    nir = tile[MicaSenseOrtho.bands.get('NIR')]
+    ndvi = (nir - red) / (nir + red)
+
+    return T_s, ndvi
+
+
+def create_tile_inputs(
+    T_s, ndvi, air1 : AirLayer, air2 : AirLayer, SW_IN, terms=None, h=0.3, w_l=0.01,
+    x_lad=0., theta_sun=35.72088909219039, G_params=G_params, vi_range=None
+):
+    """
+    Create the Surface and Radiation objects for one tile (see example.py),
+    reusing the scalar scene terms.
+
+    Parameters
+    ----------
+    T_s, ndvi : xarray.DataArray
+        Brightness temperature [K] and NDVI of the tile.
+    air1, air2 : AirLayer
+        Lower and upper air layers.
+    SW_IN : float
+        Incoming shortwave radiation [W m-2].
+    terms : dict, optional
+        Output of calc_scene_terms(). Computed here if None (the default).
+    vi_range : tuple, optional
+        Scene (min, max) NDVI for the LAI scaling (see scan_ortho()). If None (the
+        default), the range of the tile is used.
+
+    Returns
+    -------
+    surf : TileSurface
+    rad : Radiation
+    """
+    if terms is None:
+        terms = calc_scene_terms(air1, air2, h=h)
+
+    surf = TileSurface(
+        h=h, T_s=T_s, w_l=w_l, ndvi=ndvi, x_lad=x_lad, theta_sun=theta_sun, vi_range=vi_range
+    )
+    surf.T_s = surf.correct_T_b(
+        LW_IN = terms['LW_sky2'],
+        T_a = terms['T_a'],
+        tau = terms['tau'],
+        epsilon_s = surf.epsilon_s
+    )
+    # Radiation
+    SW_OUT = radiation.calc_SW_out(SW_IN, surf.albedo)
+    LW_IN = terms['LW_sky1'] * surf.epsilon_s
+    LW_OUT = radiation.calc_LW(surf.T_s, surf.epsilon_s)
+
+    rad = Radiation(SW_IN, SW_OUT, LW_IN, LW_OUT, G=None, G_params=G_params)
+    rad.set_components(SW_IN, SW_OUT, LW_IN, LW_OUT)
+
+    return surf, rad
+
+#-------------------------------------------------------------------------------
+# TILED MODEL RUNS
+#-------------------------------------------------------------------------------
+
+def iter_windows(height, width, tile=1024):
+    """
+    Iterate over (row, col) slices of tile x tile windows covering a raster.
+    """
+    for row in range(0, height, tile):
+        for col in range(0, width, tile):
+            yield slice(row, min(row + tile, height)), slice(col, min(col + tile, width))
+
+
+def create_model(model_cls, air1 : AirLayer, air2 : AirLayer, surf : Surface, rad : Radiation):
+    """
+    Create a flux model from its class (or name in model_classes).
+    """
+    model_cls = model_classes.get(model_cls, model_cls)
+
+    if issubclass(model_cls, model.BowenModel):
+        return model_cls(airlayer_2=air2, airlayer_1=air1, surface=surf, radiation=rad)
+
+    return model_cls(airlayer=air2, surface=surf, radiation=rad)
+
+
+def run_model(mod, L=None, allow_neg_flux=False):
+    """
+    Run a flux model, either iterating L to convergence (L=None) or in a single
+    pass at a given scene L. Models without a stability iteration (Neutral, Bowen)
+    ignore L.
+
+    After a single pass, mod.L is the L recomputed from the tile; callers report
+    the scene L instead (see run_tiled() and iter_model_tiles()). The single pass
+    is silenced, as FluxModel.run() reports the L difference of every iteration.
+    """
+    if L is None or isinstance(mod, (model.NeutralModel, model.BowenModel)):
+        mod.run(allow_neg_flux=allow_neg_flux)
+    else:
+        with redirect_stdout(io.StringIO()):
+            mod.run(L=L, max_i=1, allow_neg_flux=allow_neg_flux)
+
+    return mod
+
+
+def run_tile(
+    T_s, ndvi, air1 : AirLayer, air2 : AirLayer, SW_IN, L=None, terms=None,
+    model_cls=model.BrutsaertModel, allow_neg_flux=False, **kwargs
+):
+    """
+    Run a flux model over one tile.
+
+    Parameters
+    ----------
+    T_s, ndvi : xarray.DataArray
+        Brightness temperature [K] and NDVI of the tile.
+    air1, air2 : AirLayer
+        Lower and upper air layers (the model runs on air2).
+    SW_IN : float
+        Incoming shortwave radiation [W m-2].
+    L : float, optional
+        Monin-Obukhov length [m] of the scene. If given, the model makes a single
+        pass at this L; if None (the default), L is iterated to convergence on the
+        tile itself (FluxModel.run).
+    terms : dict, optional
+        Output of calc_scene_terms().
+    model_cls : type or str, optional
+        Model class, or its name in model_classes. The default is BrutsaertModel.
+    **kwargs
+        Passed to create_tile_inputs() (h, w_l, x_lad, theta_sun, G_params,
+        vi_range).
+
+    Returns
+    -------
+    mod : FluxModel
+        The model after the run.
+    """
+    surf, rad = create_tile_inputs(T_s, ndvi, air1, air2, SW_IN, terms=terms, **kwargs)
+
+    mod = create_model(model_cls, air1, air2, surf, rad)
+
+    return run_model(mod, L=L, allow_neg_flux=allow_neg_flux)
+
+
+def scan_ortho(ortho_array, tile=1024, step=1, nodata=65535.):
+    """
+    Read an ortho once, one tile at a time, to get the scene-level quantities the
+    models need: a regular (every step-th pixel) subsample of the scene and the
+    NDVI range used to scale LAI.
+
+    Parameters
+    ----------
+    ortho_array : xarray.DataArray
+        (band, y, x) ortho, lazily opened.
+    tile : int, optional
+        Tile size [pixels]. The default is 1024.
+    step : int, optional
+        Sampling interval [pixels] in x and y. The default is 1 (every valid
+        pixel, which reproduces the untiled run but holds the valid pixels of the
+        scene in memory). A step > 1 trades exactness for memory on large orthos.
+    nodata : float, optional
+        NoData value. The default is 65535.
+
+    Returns
+    -------
+    sample : xarray.DataArray
+        (band, 1, n) array of the valid sampled pixels, with the CRS of the ortho.
+    vi_range : tuple
+        Scene (min, max) NDVI over 0 < NDVI < 1 (as in Surface.calc_vi_scaled()).
+    """
+    vals = []
+    vi_min, vi_max = np.inf, -np.inf
+    for rows, cols in iter_windows(ortho_array.sizes['y'], ortho_array.sizes['x'], tile):
+        sub = ortho_array.isel(y=rows, x=cols).load()
+        # NDVI range
+        _, ndvi = get_tile_inputs(sub, nodata)
+        vi_min = min(vi_min, ndvi.where(ndvi > 0.0).min().item())
+        vi_max = max(vi_max, ndvi.where(ndvi < 1.0).max().item())
+        # Subsample
+        sub = sub.where(sub != nodata).values[:, ::step, ::step]
+        sub = sub.reshape(sub.shape[0], -1)
+        vals.append(sub[:, np.isfinite(sub).all(axis=0)])
+    vals = np.concatenate(vals, axis=1)
+
+    # Keep a (y, x) layout so that the rio accessor works on the sample.
+    sample = xr.DataArray(
+        vals[:, None, :], dims=('band','y','x'),
+        coords={'band' : ortho_array.band, 'y' : ortho_array.y[:1], 'x' : np.arange(vals.shape[1], dtype=float)}
+    )
+    sample = sample.rio.write_crs(ortho_array.rio.crs)
+
+    return sample, (vi_min, vi_max)
+
+
+def calc_scene_L(sample, air1, air2, SW_IN, nodata=65535., **kwargs):
+    """
+    Calculate the Monin-Obukhov length of a scene.
+
+    FluxModel.run() updates L from the scene mean of H_v, so tiles cannot each
+    converge on their own L without changing the result. Instead, L is iterated
+    to convergence on a regular subsample of the scene, and every tile is then
+    run once at that L.
+
+    Parameters
+    ----------
+    sample : xarray.DataArray
+        Subsample of the ortho (see scan_ortho()). A sample with step=1 reproduces
+        the untiled run exactly.
+    **kwargs
+        Passed to run_tile(). Pass the scene vi_range.
+
+    Returns
+    -------
+    L : float
+        Monin-Obukhov length [m].
+    """
+    T_s, ndvi = get_tile_inputs(sample, nodata)
+
+    mod = run_tile(T_s, ndvi, air1, air2, SW_IN, L=None, **kwargs)
+
+    return float(mod.L)
+
+
+def get_profile(ortho_array, count, tile=1024) -> dict:
+    """
+    Get the rasterio profile of a float32 GeoTIFF on the grid of an ortho, with
+    internal blocks aligned to the tiles.
+    """
+    block = int(np.gcd(tile, 256))
+    profile = {
+        'driver' : 'GTiff',
+        'height' : ortho_array.sizes['y'],
+        'width' : ortho_array.sizes['x'],
+        'count' : count,
+        'dtype' : 'float32',
+        'crs' : ortho_array.rio.crs,
+        'transform' : ortho_array.rio.transform(),
+        'nodata' : np.nan,
+        'tiled' : block >= 16,
+        'blockxsize' : block,
+        'blockysize' : block,
+        'compress' : 'deflate',
+        'BIGTIFF' : 'IF_SAFER',
+    }
+    if block < 16:
+        del profile['blockxsize'], profile['blockysize']
+
+    return profile
+
+
+def run_tiled(
+    file, out_file, air1 : AirLayer, air2 : AirLayer, SW_IN, out_vars=['LE','H'],
+    tile=1024, L=None, vi_range=None, step=1, nodata=65535., model_cls=model.BrutsaertModel,
+    allow_neg_flux=False, **kwargs
+) -> tuple:
+    """
+    Run a flux model over a full ortho in tiles and write the outputs to disk.
+
+    Only one tile of the ortho (and of each model variable) is in memory at a
+    time, besides the scene sample for L (see scan_ortho()). The scalar air-layer terms are computed once per scene. The scene-level
+    terms of the model (L and the NDVI range used to scale LAI) are determined in
+    a first read of the ortho (see scan_ortho(), calc_scene_L()), so that the
+    tiles reproduce the untiled run.
+
+    Parameters
+    ----------
+    file : str
+        Filename of the MicaSense ortho.
+    out_file : str
+        Filename of the output GeoTIFF, with one band per variable in out_vars
+        (band descriptions are set to the variable names).
+    air1, air2 : AirLayer
+        Lower and upper air layers (e.g. from create_airlayers()).
+    SW_IN : float
+        Incoming shortwave radiation [W m-2].
+    out_vars : list, optional
+        Model attributes to write. The default is ['LE','H'].
+    tile : int, optional
+        Tile size [pixels]. The default is 1024.
+    L : float, optional
+        Monin-Obukhov length [m]. Calculated with calc_scene_L() if None (the default).
+    vi_range : tuple, optional
+        Scene (min, max) NDVI. Calculated with scan_ortho() if None (the default).
+        If both L and vi_range are given, the first read of the ortho is skipped.
+    step : int, optional
+        Sampling interval for calc_scene_L() (see scan_ortho()). The default is 1,
+        which reproduces the untiled run.
+    **kwargs
+        Passed to create_tile_inputs() (h, w_l, x_lad, theta_sun, G_params).
+
+    Returns
+    -------
+    L : float
+        The Monin-Obukhov length used for the run [m].
+    vi_range : tuple
+        The scene (min, max) NDVI used for the run.
+    """
+    ortho_array = rio.open_rasterio(file, masked=True)
+
+    terms = calc_scene_terms(air1, air2, h=kwargs.get('h', 0.3))
+    if L is None or vi_range is None:
+        sample, scene_range = scan_ortho(ortho_array, tile=tile, step=step, nodata=nodata)
+        vi_range = scene_range if vi_range is None else vi_range
+    if L is None:
+        L = calc_scene_L(
+            sample, air1, air2, SW_IN, nodata=nodata, terms=terms, model_cls=model_cls,
+            allow_neg_flux=allow_neg_flux, vi_range=vi_range, **kwargs
+        )
+
+    profile = get_profile(ortho_array, len(out_vars), tile=tile)
+
+    with rasterio.open(out_file, 'w', **profile) as dst:
+        dst.descriptions = tuple(out_vars)
+        for rows, cols in iter_windows(ortho_array.sizes['y'], ortho_array.sizes['x'], tile):
+            window = Window.from_slices(rows, cols)
+            T_s, ndvi = get_tile_inputs(ortho_array.isel(y=rows, x=cols).load(), nodata)
+            # Skip empty (NoData) tiles, e.g. outside the flight area
+            if T_s.isnull().all():
+                out = np.full((len(out_vars), window.height, window.width), np.nan, dtype='float32')
+            else:
+                mod = run_tile(
+                    T_s, ndvi, air1, air2, SW_IN, L=L, terms=terms, model_cls=model_cls,
+                    allow_neg_flux=allow_neg_flux, vi_range=vi_range, **kwargs
+                )
+                out = np.stack([
+                    np.broadcast_to(
+                        np.asarray(L if var == 'L' else getattr(mod, var), dtype='float32'), T_s.shape
+                    )
+                    for var in out_vars
+                ])
+            dst.write(out, window=window)
+
+    return L, vi_range
+
+#-------------------------------------------------------------------------------
+# MULTI-MODEL RUNS
+#-------------------------------------------------------------------------------
+
+def run_models(
+    T_s, ndvi, air1 : AirLayer, air2 : AirLayer, SW_IN, models=list(model_classes),
+    Ls=None, terms=None, allow_neg_flux=False, **kwargs
+) -> dict:
+    """
+    Run several flux models over one tile, sharing a single Surface and Radiation
+    (and so R_n and G) between them.
+
+    Parameters
+    ----------
+    T_s, ndvi : xarray.DataArray
+        Brightness temperature [K] and NDVI of the tile.
+    air1, air2 : AirLayer
+        Lower and upper air layers.
+    SW_IN : float
+        Incoming shortwave radiation [W m-2].
+    models : list, optional
+        Names of the models in model_classes. The default is all four.
+    Ls : dict, optional
+        Scene Monin-Obukhov length of each model (see run_model()). If None (the
+        default), L is iterated on the tile itself.
+    terms : dict, optional
+        Output of calc_scene_terms().
+    **kwargs
+        Passed to create_tile_inputs() (h, w_l, x_lad, theta_sun, G_params,
+        vi_range).
+
+    Returns
+    -------
+    fluxes : dict
+        Output variables (flux_vars) of each model, keyed by model name.
+    """
+    surf, rad = create_tile_inputs(T_s, ndvi, air1, air2, SW_IN, terms=terms, **kwargs)
+
+    if Ls is None:
+        Ls = {}
+
+    fluxes = {}
+    for name in models:
+        mod = run_model(
+            create_model(name, air1, air2, surf, rad), L=Ls.get(name), allow_neg_flux=allow_neg_flux
+        )
+        fluxes[name] = mod.get_fluxes()
+
+    return fluxes
+
+
+def calc_scene_fluxes(sample, air1, air2, SW_IN, models=list(model_classes), nodata=65535., **kwargs) -> dict:
+    """
+    Run the models to convergence on a subsample of the scene (see scan_ortho()).
+    The scalar outputs (zeta, u_star, Psi_M, Psi_H, r_aH, L) are the scene values
+    of each model; L is then used to run the tiles.
+
+    Returns
+    -------
+    fluxes : dict
+        Output variables of each model on the sample, keyed by model name.
+    """
+    T_s, ndvi = get_tile_inputs(sample, nodata)
+
+    return run_models(T_s, ndvi, air1, air2, SW_IN, models=models, Ls=None, **kwargs)
+
+
+def get_scalars(fluxes : dict) -> dict:
+    """
+    Get the scene-level (scalar or None) outputs of each model.
+    """
+    return {
+        name : {var : val for var,val in flux.items() if val is None or np.ndim(val) == 0}
+        for name,flux in fluxes.items()
+    }
+
+
+def iter_model_tiles(
+    ortho_array, air1 : AirLayer, air2 : AirLayer, SW_IN, scene : dict, vi_range,
+    models=list(model_classes), tile=1024, nodata=65535., allow_neg_flux=False, **kwargs
+):
+    """
+    Run several flux models over an ortho, one tile at a time.
+
+    Parameters
+    ----------
+    ortho_array : xarray.DataArray
+        (band, y, x) ortho, lazily opened.
+    scene : dict
+        Output of calc_scene_fluxes().
+    vi_range : tuple
+        Scene (min, max) NDVI (see scan_ortho()).
+
+    Yields
+    ------
+    rows, cols : slice
+        Window of the tile.
+    fluxes : dict or None
+        Output variables of each model for the tile (see run_models()), with the
+        scalar outputs set to the scene values. None for empty (NoData) tiles.
+    """
+    terms = calc_scene_terms(air1, air2, h=kwargs.get('h', 0.3))
+    Ls = {name : scene[name]['L'] for name in models}
+    scalars = get_scalars(scene)
+
+    for rows, cols in iter_windows(ortho_array.sizes['y'], ortho_array.sizes['x'], tile):
+        T_s, ndvi = get_tile_inputs(ortho_array.isel(y=rows, x=cols).load(), nodata)
+        if T_s.isnull().all():
+            yield rows, cols, None
+            continue
+        fluxes = run_models(
+            T_s, ndvi, air1, air2, SW_IN, models=models, Ls=Ls, terms=terms,
+            allow_neg_flux=allow_neg_flux, vi_range=vi_range, **kwargs
+        )
+        for name in models:
+            fluxes[name].update(scalars[name])
+
+        yield rows, cols, fluxes
+
+
+def run_models_tiled(
+    file, out_file, air1 : AirLayer, air2 : AirLayer, SW_IN, models=list(model_classes),
+    out_vars=['r_bH','r_H','H','LE','ET','EF'], tile=1024, step=1, nodata=65535.,
+    allow_neg_flux=False, **kwargs
+) -> dict:
+    """
+    Run several flux models over a full ortho in one pass and write their
+    per-pixel outputs to disk.
+
+    Each tile of the ortho is read once, and its Surface, Radiation and R_n/G are
+    shared by all the models. The scene L of each stability model is determined
+    first on a subsample of the scene (see calc_scene_fluxes()).
+
+    Parameters
+    ----------
+    file : str
+        Filename of the MicaSense ortho.
+    out_file : str
+        Filename of the output GeoTIFF, with one band per model and per-pixel
+        variable (band descriptions are '<model>_<variable>', e.g. 'Dyer_LE').
+    air1, air2 : AirLayer
+        Lower and upper air layers (e.g. from create_airlayers()).
+    SW_IN : float
+        Incoming shortwave radiation [W m-2].
+    models : list, optional
+        Names of the models in model_classes. The default is all four.
+    out_vars : list, optional
+        Variables to write, where they are per-pixel for a model. The default is
+        ['r_bH','r_H','H','LE','ET','EF'].
+    tile : int, optional
+        Tile size [pixels]. The default is 1024.
+    step : int, optional
+        Sampling interval for the scene subsample (see scan_ortho()). The default
+        is 1, which reproduces the untiled run.
+    **kwargs
+        Passed to create_tile_inputs() (h, w_l, x_lad, theta_sun, G_params).
+
+    Returns
+    -------
+    scalars : dict
+        Scene-level (scalar) outputs of each model, keyed by model name.
+    """
+    ortho_array = rio.open_rasterio(file, masked=True)
+
+    sample, vi_range = scan_ortho(ortho_array, tile=tile, step=step, nodata=nodata)
+    scene = calc_scene_fluxes(
+        sample, air1, air2, SW_IN, models=models, nodata=nodata,
+        allow_neg_flux=allow_neg_flux, vi_range=vi_range, **kwargs
+    )
+    # Bands: per-pixel variables of each model
+    bands = [
+        (name, var) for name in models for var in out_vars
+        if scene[name].get(var) is not None and np.ndim(scene[name][var]) > 0
+    ]
+
+    profile = get_profile(ortho_array, len(bands), tile=tile)
+
+    with rasterio.open(out_file, 'w', **profile) as dst:
+        dst.descriptions = tuple(name + '_' + var for name,var in bands)
+        tiles = iter_model_tiles(
+            ortho_array, air1, air2, SW_IN, scene, vi_range, models=models, tile=tile,
+            nodata=nodata, allow_neg_flux=allow_neg_flux, **kwargs
+        )
+        for rows, cols, fluxes in tiles:
+            window = Window.from_slices(rows, cols)
+            if fluxes is None:
+                out = np.full((len(bands), window.height, window.width), np.nan, dtype='float32')
+            else:
+                out = np.stack([np.asarray(fluxes[name][var], dtype='float32') for name,var in bands])
+            dst.write(out, window=window)
+
+    return get_scalars(scene)
+
+#-------------------------------------------------------------------------------
+# PER-PIXEL STABILITY ITERATION
+#-------------------------------------------------------------------------------
+
+def _flatten(val, shape):
+    # Scalars are kept as scalars; arrays are flattened to the pixel dimension.
+    if np.ndim(val) == 0:
+        return val
+    return np.broadcast_to(np.asarray(val, dtype=float), shape).reshape(-1)
+
+
+def _take(val, idx):
+    if np.ndim(val) == 0:
+        return val
+    return val[idx]
+
+
+def _step_stability(mod, L, use_psi_0=True, allow_neg_flux=False) -> dict:
+    """
+    One fixed-point update of L for a set of pixels (FluxModel._run() with a
+    per-pixel rather than a scene-mean L). mod is a shallow copy of the model
+    whose surface/radiation hold only those pixels.
+    """
+    zeta = mod.calc_zeta(L)
+    Psi_M = mod.calc_Psi_M(zeta)
+    Psi_H = mod.calc_Psi_H(zeta)
+    if use_psi_0:
+        Psi_M0 = mod.calc_Psi_M(mod.surface.z_0m / L)
+        Psi_H0 = mod.calc_Psi_H(mod.surface.z_0h / L)
+    else:
+        Psi_M0 = 0
+        Psi_H0 = 0
+    u_star = mod.calc_ustar(Psi_M, Psi_m0=Psi_M0)
+    mod.r_aH = mod.calc_r_aH(Psi_M, Psi_H, Psi_M0=Psi_M0, Psi_H0=Psi_H0)
+    r_bH = mod.calc_r_bH(u_star=u_star, L=L, c=90.)
+    r_H = mod.calc_r_H(r_bH=r_bH)
+    H = mod.calc_H(mod.surface.theta_s, r_H)
+    if not allow_neg_flux:
+        H = np.where(H < 0.0, 0.0, H)
+    LE = mod.calc_LE(H)
+    LE = np.where(LE < 0.0, 0.0, LE)
+    H_v = mod.calc_Hv(H, LE)
+
+    return {
+        'zeta' : zeta, 'Psi_M' : Psi_M, 'Psi_H' : Psi_H, 'u_star' : u_star,
+        'r_aH' : mod.r_aH, 'r_bH' : r_bH, 'r_H' : r_H, 'H' : H, 'LE' : LE,
+        'L' : mod.calc_L(u_star, H_v),
+    }
+
+
+def solve_stability(
+    mod, L=np.inf, use_psi_0=True, max_i=15, L_thresh=0.001, rtol=0.,
+    allow_neg_flux=False, chunk_size=1_000_000
+) -> dict:
+    """
+    Solve for the Monin-Obukhov length of every pixel by fixed-point iteration.
+
+    This is the per-pixel counterpart of FluxModel.run() (which iterates on the
+    scene-mean L) and a vectorised replacement for FluxModel.run_pix(). Only the
+    pixels that have not converged are carried into the next iteration: each
+    iteration gathers the active pixels into compact arrays, updates them with
+    the model's own methods, and writes the converged ones out.
+
+    Parameters
+    ----------
+    mod : FluxModel
+        Model with its surface and radiation set (e.g. from create_model()). Only
+        the model class, the air layer and the per-pixel inputs in stab_inputs
+        are used; the model itself is not modified.
+    L : float, optional
+        Initial Monin-Obukhov length [m]. The default is np.inf.
+    use_psi_0 : bool, optional
+        Whether to use the Psi_0 terms. The default is True.
+    max_i : int, optional
+        Maximum number of iterations. The default is 15.
+    L_thresh : float, optional
+        Absolute convergence threshold on the change in L [m]. The default is 0.001.
+    rtol : float, optional
+        Relative convergence threshold on the change in L. The default is 0.
+    allow_neg_flux : bool, optional
+        Whether to allow negative H. The default is False.
+    chunk_size : int, optional
+        Number of pixels solved at a time (bounds the memory use). The default is
+        1,000,000.
+
+    Returns
+    -------
+    out : dict
+        stab_vars as arrays of the shape of surface.theta_s (NaN outside the
+        valid pixels), and
+        'n_iter' : number of iterations of each pixel,
+        'converged' : whether each pixel converged within max_i iterations,
+        'flag' : model flag of each pixel (F_ERROR where the solve failed),
+        'n_active' : number of active pixels at each iteration.
+    """
+    shape = np.shape(mod.surface.theta_s)
+    n = int(np.prod(shape))
+
+    inputs = {
+        attr : {var : _flatten(getattr(getattr(mod, attr), var), shape) for var in stab_vars_}
+        for attr, stab_vars_ in stab_inputs.items()
+    }
+    valid = np.isfinite(_flatten(mod.surface.theta_s, shape)) & np.isfinite(
+        np.broadcast_to(inputs['radiation']['R_n'] - inputs['radiation']['G'], (n,))
+    )
+
+    out = {var : np.full(n, np.nan) for var in stab_vars}
+    n_iter = np.zeros(n, dtype='int16')
+    converged = np.zeros(n, dtype=bool)
+    flag = np.full(n, model.flag_dict.get('NO_FLAG')[0], dtype='uint8')
+    n_active = np.zeros(max_i, dtype=int)
+
+    for start in range(0, n, chunk_size):
+        idx = start + np.flatnonzero(valid[start:start + chunk_size])
+        L_i = np.full(idx.size, L, dtype=float)
+
+        for i in range(max_i):
+            if idx.size == 0:
+                break
+            n_active[i] += idx.size
+            # Model restricted to the active pixels
+            sub = copy.copy(mod)
+            for attr, vals in inputs.items():
+                setattr(sub, attr, SimpleNamespace(**{var : _take(val, idx) for var,val in vals.items()}))
+
+            with np.errstate(all='ignore'):
+                res = _step_stability(sub, L_i, use_psi_0=use_psi_0, allow_neg_flux=allow_neg_flux)
+
+            L_new = np.broadcast_to(res['L'], idx.shape)
+            failed = np.isnan(L_new)
+            done = np.isclose(L_new, L_i, rtol=rtol, atol=L_thresh) | failed
+            last = done | (i == max_i - 1)
+
+            for var in stab_vars:
+                out[var][idx[last]] = np.broadcast_to(res[var], idx.shape)[last]
+            n_iter[idx[last]] = i + 1
+            converged[idx[done & ~failed]] = True
+            flag[idx[failed]] = model.flag_dict.get('F_ERROR')[0]
+
+            idx = idx[~last]
+            L_i = L_new[~last]
+
+    out = {var : arr.reshape(shape) for var,arr in out.items()}
+    out.update({
+        'n_iter' : n_iter.reshape(shape),
+        'converged' : converged.reshape(shape),
+        'flag' : flag.reshape(shape),
+        'n_active' : n_active[n_active > 0],
+    })
+    return out
+
+
+def benchmark_stability(n_pix=10_000_000, model_cls=model.BrutsaertModel, seed=0, **kwargs) -> dict:
+    """
+    Time solve_stability() on a synthetic scene of n_pix pixels (Ramajal-like
+    air layer, T_s of 295-320 K, LAI of 1-4).
+
+    Returns
+    -------
+    stats : dict
+        'n_pix', 'seconds', 'pix_per_s', 'mean_iter', 'max_iter', 'frac_converged'
+        and 'n_active' (active pixels at each iteration).
+    """
+    rng = np.random.default_rng(seed)
+    h = 0.3
+    air = AirLayer(z=60.5, u=4., T_a=293., p_a=97.5, h_r=35., z_0=h)
+    R_n = rng.uniform(300., 650., n_pix)
+    surf = SimpleNamespace(
+        theta_s=rng.uniform(295., 320., n_pix), lai=rng.uniform(1., 4., n_pix),
+        d_0=0.65*h, z_0m=0.125*h, z_0h=0.0125*h, h=h, w_l=0.01,
+    )
+    rad = SimpleNamespace(R_n=R_n, G=0.1*R_n)
+
+    mod = model_cls(airlayer=air, surface=surf, radiation=rad)
+
+    t0 = time.perf_counter()
+    out = solve_stability(mod, **kwargs)
+    seconds = time.perf_counter() - t0
+
+    valid = (out['n_iter'] > 0) & (out['flag'] != model.flag_dict.get('F_ERROR')[0])
+    stats = {
+        'n_pix' : n_pix,
+        'seconds' : seconds,
+        'pix_per_s' : n_pix / seconds,
+        'mean_iter' : out['n_iter'][valid].mean(),
+        'max_iter' : out['n_iter'].max(),
+        'frac_converged' : out['converged'][valid].mean(),
+        'n_active' : out['n_active'],
+    }
+    return stats
+
+#-------------------------------------------------------------------------------
+# FOOTPRINT WEIGHTS
+#-------------------------------------------------------------------------------
+
+class FootprintWeights():
+    """
+    Sparse flux-footprint weights of one flight on the pixel grid of its ortho.
+
+    Only the pixels with non-zero weight are stored (as flat indices into the
+    grid), so the footprint-weighted sum of any number of variables is one
+    gather of those pixels and a single matrix-vector product. As in
+    ramajal_models.csv (SRC_WT_MEAN), NaN pixels contribute zero and the weights
+    are not renormalised.
+
+    Parameters
+    ----------
+    idx : array-like
+        Flat (row-major) indices of the footprint pixels in the grid.
+    w : array-like
+        Weight of each footprint pixel.
+    shape : tuple
+        (y, x) shape of the grid.
+    flight : str, optional
+        Flight identifier.
+    """
+    def __init__(self, idx, w, shape, flight=None):
+        self.idx = np.asarray(idx, dtype=np.int64)
+        self.w = np.asarray(w, dtype=float)
+        self.shape = tuple(int(n) for n in shape)
+        self.flight = flight
+        self.rows, self.cols = np.unravel_index(self.idx, self.shape)
+
+    def __repr__(self):
+        return f"FootprintWeights(flight={self.flight}, n_pix={len(self.idx)}, sum={self.w.sum():.4g})"
+
+    @classmethod
+    def from_grid(cls, weights, flight=None, min_weight=0.):
+        """
+        Create from a dense weight grid aligned to the ortho (weights <= min_weight
+        and NaNs are dropped).
+        """
+        arr = np.asarray(weights, dtype=float)
+        flat = arr.reshape(-1)
+        idx = np.flatnonzero(np.isfinite(flat) & (flat > min_weight))
+
+        return cls(idx, flat[idx], arr.shape, flight=flight)
+
+    def save(self, file):
+        np.savez(file, idx=self.idx, w=self.w, shape=self.shape, flight=str(self.flight))
+
+    @classmethod
+    def load(cls, file):
+        with np.load(file) as f:
+            return cls(f['idx'], f['w'], f['shape'], flight=f['flight'].item())
+
+    @property
+    def bounds(self):
+        """
+        (row, col) slices of the bounding box of the footprint.
+        """
+        if not len(self.idx):
+            return slice(0, 0), slice(0, 0)
+        return (
+            slice(int(self.rows.min()), int(self.rows.max()) + 1),
+            slice(int(self.cols.min()), int(self.cols.max()) + 1)
+        )
+
+    def window(self, rows, cols):
+        """
+        Footprint pixels inside a window of the grid.
+
+        Returns
+        -------
+        idx : numpy.ndarray
+            Flat indices of the pixels within the window.
+        w : numpy.ndarray
+            Their weights.
+        """
+        rows = slice(*rows.indices(self.shape[0]))
+        cols = slice(*cols.indices(self.shape[1]))
+        inside = (
+            (self.rows >= rows.start) & (self.rows < rows.stop) &
+            (self.cols >= cols.start) & (self.cols < cols.stop)
+        )
+        idx = (self.rows[inside] - rows.start) * (cols.stop - cols.start) + (self.cols[inside] - cols.start)
+
+        return idx, self.w[inside]
+
+    def check_shape(self, shape):
+        """
+        Raise a ValueError if the weights are not on a grid of `shape` (y, x).
+        """
+        if tuple(int(n) for n in self.shape) != tuple(int(n) for n in shape):
+            raise ValueError(
+                f"Footprint weights of flight {self.flight} are on a {tuple(self.shape)} grid, "
+                f"not the {tuple(shape)} grid of the raster."
+            )
+
+    def weighted_sum(self, arrs, rows=None, cols=None) -> np.ndarray:
+        """
+        Footprint-weighted sums (SRC_WT_MEAN) of a stack of variables.
+
+        Parameters
+        ----------
+        arrs : array-like
+            (n_vars, y, x) stack of variables on the full grid or, if rows/cols
+            are given, on that window of it.
+        rows, cols : slice, optional
+            Window of the grid covered by arrs. A ValueError is raised if arrs
+            is not on the grid (or window) of the weights.
+
+        Returns
+        -------
+        sums : numpy.ndarray
+            Weighted sum of each variable (length n_vars).
+        """
+        arrs = np.asarray(arrs, dtype=float)
+        if rows is None:
+            self.check_shape(arrs.shape[1:])
+            idx, w = self.idx, self.w
+        else:
+            win = (rows.indices(self.shape[0]), cols.indices(self.shape[1]))
+            if arrs.shape[1:] != tuple(len(range(*r)) for r in win):
+                raise ValueError(
+                    f"Window ({rows}, {cols}) of shape {arrs.shape[1:]} is not within the "
+                    f"{tuple(self.shape)} grid of the footprint weights of flight {self.flight}."
+                )
+            idx, w = self.window(rows, cols)
+        vals = arrs.reshape(arrs.shape[0], -1)[:, idx]
+
+        return np.nan_to_num(vals, nan=0.0) @ w
+
+
+# Footprint weights of each flight and min_weight (see get_fp_weights())
+_fp_cache = {}
+
+def get_fp_weights(flight, weights=None, cache_dir=None, min_weight=0., shape=None) -> FootprintWeights:
+    """
+    Get the footprint weights of a flight, cached in memory and (optionally) on
+    disk as '<cache_dir>/fp_weights_<flight>_<min_weight>.npz'.
+
+    Parameters
+    ----------
+    flight : str
+        Flight identifier.
+    weights : array-like, optional
+        Dense weight grid aligned to the ortho. If given, the weights are
+        (re)built from it and replace any cached entry for the flight and
+        min_weight.
+    cache_dir : str, optional
+        Directory of the on-disk cache. The default (None) caches in memory only.
+    min_weight : float, optional
+        Weights <= min_weight are dropped (see FootprintWeights.from_grid()).
+    shape : tuple, optional
+        (y, x) shape of the ortho. If given, weights on any other grid (e.g. a
+        stale cache entry) raise a ValueError.
+
+    Returns
+    -------
+    fp : FootprintWeights
+    """
+    key = (flight, float(min_weight))
+    file = None if cache_dir is None else os.path.join(
+        cache_dir, f"fp_weights_{flight}_{float(min_weight):g}.npz"
+    )
+
+    if weights is not None:
+        fp = FootprintWeights.from_grid(weights, flight=flight, min_weight=min_weight)
+        if file is not None:
+            fp.save(file)
+    elif key in _fp_cache:
+        fp = _fp_cache[key]
+    elif file is not None and os.path.isfile(file):
+        fp = FootprintWeights.load(file)
+    else:
+        raise ValueError(f"No footprint weights for flight {flight} (min_weight={min_weight}).")
+
+    if shape is not None:
+        fp.check_shape(shape)
+    _fp_cache[key] = fp
+
+    return fp
+
+
+def calc_src_wt_means(file, fp : FootprintWeights) -> pd.Series:
+    """
+    Footprint-weighted means (SRC_WT_MEAN) of every band of a model output
+    raster (e.g. from run_models_tiled()). Only the bounding box of the footprint
+    is read, and all bands are reduced in one matrix-vector product. The raster
+    must be on the grid of the footprint weights (a ValueError is raised
+    otherwise).
+
+    Returns
+    -------
+    src_wt : pandas.Series
+        SRC_WT_MEAN of each band, indexed by band description.
+    """
+    arr = rio.open_rasterio(file, masked=True)
+    names = arr.attrs.get('long_name')
+    if names is None:
+        names = [str(b) for b in arr.band.values]
+    elif isinstance(names, str):
+        names = [names]
+
+    fp.check_shape((arr.sizes['y'], arr.sizes['x']))
+    rows, cols = fp.bounds
+    vals = arr.isel(y=rows, x=cols).values
+
+    return pd.Series(fp.weighted_sum(vals, rows, cols), index=list(names), name='SRC_WT_MEAN')
+
+#-------------------------------------------------------------------------------
+# SUMMARY STATISTICS
+#-------------------------------------------------------------------------------
+
+def iter_raster_tiles(file, tile=1024):
+    """
+    Iterate over tiles of a model output raster written by run_models_tiled()
+    (bands named '<model>_<variable>').
+
+    Yields
+    ------
+    rows, cols : slice
+        Window of the tile.
+    fluxes : dict
+        Per-pixel variables of each model for the tile, keyed by model name.
+    """
+    arr = rio.open_rasterio(file, masked=True)
+    names = arr.attrs.get('long_name')
+    if names is None:
+        names = ()
+    elif isinstance(names, str):
+        names = (names,)
+    if len(names) != arr.sizes['band'] or not all('_' in name for name in names):
+        raise ValueError(
+            f"{file} needs one '<model>_<variable>' description per band (as "
+            f"written by run_models_tiled()), got: {list(names)}"
+        )
+    bands = [name.split('_', 1) for name in names]
+
+    for rows, cols in iter_windows(arr.sizes['y'], arr.sizes['x'], tile):
+        vals = arr.isel(y=rows, x=cols).values
+        fluxes = {}
+        for (name, var), val in zip(bands, vals):
+            fluxes.setdefault(name, {})[var] = val
+
+        yield rows, cols, fluxes
+
+
+class FluxSummary():
+    """
+    Summary statistics (sum_stats) of the output variables of several models,
+    accumulated tile by tile in a single pass over the model outputs.
+
+    MEAN, STD, MIN and MAX are exact (STD with ddof=0, as xarray). MEDIAN is
+    estimated from a fixed-bin histogram (see flux_bins and StreamStats), or to
+    within a relative error alpha by a QuantileSketch if alpha is given.
+    SRC_WT_MEAN is the sum of weights * values over the valid pixels, so NaN
+    pixels inside the footprint count as zero (as in ramajal_models.csv); all
+    variables and models of a tile are weighted in one matrix-vector product
+    (see FootprintWeights). Scalar (scene-level) variables only have a MEAN.
+
+    Parameters
+    ----------
+    models : list, optional
+        Model names. The default is all four.
+    variables : list, optional
+        Variables to summarise. The default is flux_vars.
+    weights : FootprintWeights or array-like, optional
+        Footprint weights on the grid of the model outputs, for SRC_WT_MEAN.
+    alpha : float, optional
+        Relative accuracy of the MEDIAN. If None (the default), the flux_bins
+        histograms are used.
+    """
+    def __init__(self, models=list(model_classes), variables=flux_vars, weights=None, alpha=None):
+        self.models = list(models)
+        self.variables = list(variables)
+        if weights is not None and not isinstance(weights, FootprintWeights):
+            weights = FootprintWeights.from_grid(weights)
+        self.weights = weights
+        self.alpha = alpha
+        self.stats = {}
+        self.wt_sums = {}
+        self.scalars = {}
+
+    def update(self, rows, cols, fluxes):
+        """
+        Add a tile (as yielded by iter_model_tiles() or iter_raster_tiles()).
+        """
+        if fluxes is None:
+            return self
+
+        keys = []
+        vals = []
+        for name in self.models:
+            for var in self.variables:
+                val = fluxes.get(name, {}).get(var)
+                if val is None:
+                    continue
+                if np.ndim(val) == 0:
+                    self.scalars[(name, var)] = float(val)
+                    continue
+                val = np.asarray(val, dtype=float)
+                if (name, var) not in self.stats:
+                    self.stats[(name, var)] = StreamStats(
+                        flux_bins.get(var, flux_bins['LE']), ddof=0, alpha=self.alpha
+                    )
+                self.stats[(name, var)].update(val)
+                keys.append((name, var))
+                vals.append(val)
+
+        if self.weights is not None and keys:
+            sums = self.weights.weighted_sum(vals, rows, cols)
+            for key, val in zip(keys, sums):
+                self.wt_sums[key] = self.wt_sums.get(key, 0.) + val
+
+        return self
+
+    def update_scalars(self, scalars : dict):
+        """
+        Add the scene-level outputs of each model (e.g. from run_models_tiled()).
+        """
+        for name, flux in scalars.items():
+            for var, val in flux.items():
+                if var in self.variables and val is not None and np.ndim(val) == 0:
+                    self.scalars[(name, var)] = float(val)
+        return self
+
+    def get_stats(self, name, var) -> dict:
+        """
+        Summary statistics of one variable of one model.
+        """
+        stats = dict.fromkeys(sum_stats, np.nan)
+        if (name, var) in self.scalars:
+            stats['MEAN'] = self.scalars[(name, var)]
+        elif (name, var) in self.stats:
+            st = self.stats[(name, var)]
+            stats.update({
+                'MEAN' : st.mean if st.n else np.nan,
+                'MAX' : st.max if st.n else np.nan,
+                'MIN' : st.min if st.n else np.nan,
+                'MEDIAN' : st.quantile(0.5).item(),
+                'STD' : st.std,
+                'SRC_WT_MEAN' : self.wt_sums.get((name, var), np.nan),
+            })
+        return stats
+
+    def to_row(self) -> dict:
+        """
+        Summary as one wide row, with columns named '<stat>/<variable>/<model>'
+        (see summary_columns()).
+        """
+        row = {}
+        for name in self.models:
+            for var in self.variables:
+                stats = self.get_stats(name, var)
+                row.update({'/'.join([stat, var, name]) : stats[stat] for stat in sum_stats})
+        return row
+
+
+def summary_columns(models=list(model_classes), variables=flux_vars, stats=sum_stats) -> list:
+    """
+    Names of the statistic columns of the wide summary table.
+    """
+    return ['/'.join([stat, var, name]) for name in models for var in variables for stat in stats]
+
+
+def summarise_flight(
+    tiles, models=list(model_classes), variables=flux_vars, weights=None, scalars=None, alpha=None
+) -> dict:
+    """
+    Summarise the model outputs of one flight in a single pass over its tiles.
+
+    Parameters
+    ----------
+    tiles : iterable
+        (rows, cols, fluxes) tiles, from iter_model_tiles() or iter_raster_tiles().
+    weights : FootprintWeights or array-like, optional
+        Footprint weights for SRC_WT_MEAN (e.g. from get_fp_weights()).
+    scalars : dict, optional
+        Scene-level outputs of each model (as returned by run_models_tiled()),
+        for tiles read back from disk.
+    alpha : float, optional
+        Relative accuracy of the MEDIAN (see FluxSummary).
+
+    Returns
+    -------
+    row : dict
+        Wide summary row (see FluxSummary.to_row()).
+    """
+    summ = FluxSummary(models=models, variables=variables, weights=weights, alpha=alpha)
+    for rows, cols, fluxes in tiles:
+        summ.update(rows, cols, fluxes)
+    if scalars:
+        summ.update_scalars(scalars)
+
+    return summ.to_row()
+
+
+def summarise_raster(file, tile=1024, quantiles=(0.5,), alpha=0.001, n_jobs=1) -> pd.DataFrame:
+    """
+    Summary statistics of every band of a raster (e.g. the LE/H output of
+    run_tiled()) from a single read, one tile at a time.
+
+    Count, mean, standard deviation (ddof=0), min and max are exact (Welford's
+    method); quantiles are within a relative error alpha (QuantileSketch). Memory
+    use is one tile plus the sketches, independent of the raster size.
+
+    Parameters
+    ----------
+    file : str
+        Raster filename.
+    tile : int, optional
+        Tile size [pixels]. The default is 1024.
+    quantiles : tuple, optional
+        Quantiles to estimate. The default is (0.5,) (the median).
+    alpha : float, optional
+        Relative accuracy of the quantiles. The default is 0.001.
+    n_jobs : int, optional
+        Number of threads reading and reducing tiles; the partial statistics are
+        combined with StreamStats.merge(). The default is 1.
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        One row per band (indexed by band description, if any), with columns
+        n, mean, std, min, max and pXX for each quantile.
+    """
+    arr = rio.open_rasterio(file, masked=True)
+    names = arr.attrs.get('long_name')
+    if names is None:
+        names = [str(b) for b in arr.band.values]
+    elif isinstance(names, str):
+        names = [names]
+
+    def reduce(windows):
+        stats = [StreamStats(ddof=0, alpha=alpha) for _ in names]
+        for rows, cols in windows:
+            for st, vals in zip(stats, arr.isel(y=rows, x=cols).values):
+                st.update(vals)
+        return stats
+
+    windows = list(iter_windows(arr.sizes['y'], arr.sizes['x'], tile))
+    if n_jobs == 1:
+        stats = reduce(windows)
+    else:
+        with futures.ThreadPoolExecutor(max_workers=n_jobs) as ex:
+            parts = list(ex.map(reduce, [windows[i::n_jobs] for i in range(n_jobs)]))
+        stats = parts[0]
+        for part in parts[1:]:
+            for st, other in zip(stats, part):
+                st.merge(other)
+
+    df = pd.DataFrame([st.summary(quantiles=quantiles) for st in stats], index=list(names))
+
+    return df
+
+
+def write_summary(file, rows, models=list(model_classes), variables=flux_vars) -> pd.DataFrame:
+    """
+    Write per-flight summary rows to a wide Parquet table: one row per flight,
+    with 'FlightDateTime' and 'Flight' timestamps and one float64 column per
+    statistic, variable and model.
+
+    Parameters
+    ----------
+    file : str
+        Output filename (.parquet).
+    rows : list
+        Dicts with 'FlightDateTime', 'Flight' and the output of summarise_flight().
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        The table as written.
+    """
+    cols = summary_columns(models, variables)
+    df = pd.DataFrame(list(rows))
+    df = df.reindex(columns=['FlightDateTime', 'Flight'] + cols)
+    df[cols] = df[cols].astype('float64')
+
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), file)
+
+    return df
+
+
+def read_summary(file, stat=None, models=None, variables=None) -> pd.DataFrame:
+    """
+    Read the wide summary table written by write_summary(). Only the requested
+    columns are read.
+
+    Parameters
+    ----------
+    file : str
+        Parquet file written by write_summary().
+    stat : str, optional
+        Statistic to read (e.g. 'SRC_WT_MEAN'). If given, the columns are a
+        (Variable, Model) MultiIndex, as uav_flux.pivot(columns=['Variable','Model'],
+        values=stat) in figs.py. The default (None) reads all statistics.
+    models, variables : list, optional
+        Models/variables to read. The default (None) reads all.
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        Summary table indexed by FlightDateTime.
+    """
+    names = pq.read_schema(file).names
+    cols = [
+        col for col in names if col.count('/') == 2 and
+        (stat is None or col.split('/')[0] == stat) and
+        (variables is None or col.split('/')[1] in variables) and
+        (models is None or col.split('/')[2] in models)
+    ]
+    df = pd.read_parquet(file, columns=['FlightDateTime', 'Flight'] + cols)
+    df = df.set_index('FlightDateTime', drop=False)
+
+    if stat is not None:
+        df = df[cols]
+        df.columns = pd.MultiIndex.from_tuples(
+            [tuple(col.split('/')[1:]) for col in cols], names=['Variable', 'Model']
+        )
+    return df
+
+
+def long_to_wide(df : pd.DataFrame) -> pd.DataFrame:
+    """
+    Convert a long-format model summary (e.g. ramajal_models.csv, read with
+    utils.read_results()) to the wide layout of write_summary().
+    """
+    wide = df.pivot(index=['FlightDateTime', 'Flight'], columns=['Model', 'Variable'], values=sum_stats)
+    wide.columns = ['/'.join([stat, var, name]) for stat, name, var in wide.columns]
+    wide = wide.reindex(columns=summary_columns(
+        models=df.Model.unique(), variables=[var for var in flux_vars if var in set(df.Variable)]
+    ))
+
+    return wide.reset_index()
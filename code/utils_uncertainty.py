@@ -0,0 +1,626 @@
+#!usr/bin/env python
+# -*- coding: utf-8 -*-
+#––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––
+
+__author__ = 'Bryn Morgan'
+__contact__ = 'bryn.morgan@geog.ucsb.edu'
+__copyright__ = '(c) Bryn Morgan 2023'
+
+__license__ = 'MIT'
+__date__ = 'Mon 19 Oct 26 14:03:51'
+__version__ = '1.0'
+__status__ = 'initial release'
+__url__ = ''
+
+"""
+
+Name:           utils_uncertainty.py
+Compatibility:  Python 3.7.0
+Description:    Monte-Carlo propagation of input uncertainty (calibration
+                standard errors, UAV-tower residuals) through the LE models,
+                with streaming (chunked) reduction of the output distributions,
+                and Sobol global sensitivity indices of the LE models.
+
+URL:            https://
+
+Requires:       numpy, pandas, scipy, aeroet
+
+Dev ToDo:       None
+
+AUTHOR:         Bryn Morgan
+ORGANIZATION:   University of California, Santa Barbara
+Contact:        bryn.morgan@geog.ucsb.edu
+Copyright:      (c) Bryn Morgan 2023
+
+
+"""
+
+
+#-------------------------------------------------------------------------------
+# IMPORTS
+#-------------------------------------------------------------------------------
+import warnings
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+from scipy.stats import qmc
+
+from aeroet import AirLayer
+
+import utils_sensitivity as sens
+import correct_temp
+
+#-------------------------------------------------------------------------------
+#  VARIABLES
+#-------------------------------------------------------------------------------
+# Perturbed inputs of each model
+mc_vars = {
+    'LE' : ['T_s', 'r_H', 'T_a', 'h_r', 'SW_IN', 'p_a'],
+    'LE_hat' : ['T_s', 'T_a1', 'h_r1', 'p_a1', 'T_a2', 'h_r2', 'p_a2', 'SW_IN'],
+}
+# Physical bounds the samples are clipped to
+mc_bounds = {
+    'r_H' : (1e-3, np.inf), 'h_r' : (0., 100.), 'h_r1' : (0., 100.), 'h_r2' : (0., 100.),
+}
+# Ranges of the inputs swept by generate_partials() (temperatures in °C)
+sobol_bounds = {
+    'T_s' : (0., 60.), 'r_H' : (1., 100.), 'T_a' : (0., 45.), 'h_r' : (0., 100.),
+}
+# Histogram bins used for the quantiles of each output
+mc_bins = {
+    'LE' : np.linspace(-1000., 2000., 30001),
+    'H' : np.linspace(-1000., 2000., 30001),
+    'EF' : np.linspace(-5., 5., 10001),
+}
+
+#-------------------------------------------------------------------------------
+# STREAMING STATISTICS
+#-------------------------------------------------------------------------------
+
+class QuantileSketch():
+    """
+    Quantile sketch with bounded relative error (DDSketch; Masson et al., 2019).
+
+    Values are counted in logarithmically spaced buckets (separately for positive
+    and negative values), so any quantile is returned to within a relative error
+    of alpha, whatever the range of the data. The number of buckets grows with
+    the log of the dynamic range only (~ln(max/min_value) / (2 * alpha)).
+
+    Parameters
+    ----------
+    alpha : float, optional
+        Relative accuracy of the quantiles. The default is 0.001.
+    min_value : float, optional
+        Values with |x| < min_value are counted as zero. The default is 1e-9.
+    """
+    def __init__(self, alpha=0.001, min_value=1e-9):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self._log_gamma = np.log(self.gamma)
+        self.min_value = min_value
+        self.n = 0
+        self.n_zero = 0
+        # Bucket counts of positive and negative values, from bucket index offset
+        self.counts = {1 : np.zeros(0, dtype=np.int64), -1 : np.zeros(0, dtype=np.int64)}
+        self.offset = {1 : 0, -1 : 0}
+
+    def _add(self, sign, k, counts):
+        # Add counts of bucket indices k to the buckets of one sign.
+        if not len(k):
+            return
+        lo, hi = k.min(), k.max()
+        if len(self.counts[sign]):
+            lo = min(lo, self.offset[sign])
+            hi = max(hi, self.offset[sign] + len(self.counts[sign]) - 1)
+            grown = np.zeros(hi - lo + 1, dtype=np.int64)
+            start = self.offset[sign] - lo
+            grown[start:start + len(self.counts[sign])] = self.counts[sign]
+        else:
+            grown = np.zeros(hi - lo + 1, dtype=np.int64)
+        grown += np.bincount(k - lo, weights=counts, minlength=len(grown)).astype(np.int64)
+        self.counts[sign] = grown
+        self.offset[sign] = lo
+
+    def update(self, x):
+        x = np.asarray(x, dtype=float).ravel()
+        x = x[np.isfinite(x)]
+        if not len(x):
+            return self
+        self.n += len(x)
+        zero = np.abs(x) < self.min_value
+        self.n_zero += int(zero.sum())
+        for sign in (1, -1):
+            vals = np.abs(x[~zero & (np.sign(x) == sign)])
+            k = np.ceil(np.log(vals) / self._log_gamma).astype(np.int64)
+            self._add(sign, k, np.ones(len(k)))
+        return self
+
+    def merge(self, other):
+        if other.n:
+            if other.alpha != self.alpha:
+                raise ValueError("Cannot merge sketches with different alpha.")
+            for sign in (1, -1):
+                k = other.offset[sign] + np.arange(len(other.counts[sign]))
+                self._add(sign, k, other.counts[sign])
+            self.n += other.n
+            self.n_zero += other.n_zero
+        return self
+
+    def _values(self, sign):
+        # Representative value of each bucket (relative error <= alpha)
+        k = self.offset[sign] + np.arange(len(self.counts[sign]))
+        return sign * 2 * self.gamma**k / (self.gamma + 1)
+
+    def quantile(self, q):
+        """
+        Estimate quantile(s) q (rank q * (n - 1), as numpy's 'lower' method).
+        """
+        q = np.asarray(q, dtype=float)
+        if not self.n:
+            return np.full(q.shape, np.nan)
+        # Buckets in increasing order of value: negative, zero, positive
+        vals = np.concatenate([self._values(-1)[::-1], [0.], self._values(1)])
+        counts = np.concatenate([self.counts[-1][::-1], [self.n_zero], self.counts[1]])
+        cdf = np.cumsum(counts)
+        k = np.searchsorted(cdf, np.floor(q * (self.n - 1)), side='right')
+
+        return vals[np.minimum(k, len(vals) - 1)]
+
+
+class StreamStats():
+    """
+    Summary statistics of a variable accumulated chunk by chunk.
+
+    The count, mean and variance are combined with Chan et al.'s parallel form
+    of Welford's algorithm, and quantiles are estimated from a fixed-bin
+    histogram (exact to within one bin width), so memory does not grow with
+    the number of samples. Samples outside the bins are counted but not
+    located, so quantiles that fall among them are NaN (with a warning). With alpha, a QuantileSketch replaces the histogram and
+    bounds the relative error of the quantiles instead. StreamStats from different
+    chunks or workers can be combined with merge().
+
+    Parameters
+    ----------
+    bins : array-like, optional
+        Histogram bin edges used for the quantiles.
+    ddof : int, optional
+        Delta degrees of freedom of the standard deviation. The default is 1.
+    alpha : float, optional
+        If given, quantiles are estimated with a QuantileSketch of relative
+        accuracy alpha instead of the histogram (bins are then ignored), for
+        variables whose range is not known in advance.
+    """
+    def __init__(self, bins=mc_bins['LE'], ddof=1, alpha=None):
+        self.bins = np.asarray(bins, dtype=float)
+        self.ddof = ddof
+        self.sketch = QuantileSketch(alpha) if alpha else None
+        self.n = 0
+        self.mean = 0.
+        self.M2 = 0.
+        self.min = np.inf
+        self.max = -np.inf
+        # Includes under- (x < bins[0]) and overflow (x >= bins[-1]) counts
+        self.counts = np.zeros(len(self.bins) + 1, dtype=np.int64)
+
+    def __repr__(self):
+        return f"StreamStats(n={self.n}, mean={self.mean:.4g}, std={self.std:.4g})"
+
+    def _combine(self, n, mean, M2):
+        n_tot = self.n + n
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (n / n_tot)
+        self.M2 = self.M2 + M2 + delta**2 * (self.n * n / n_tot)
+        self.n = n_tot
+
+    def update(self, x):
+        x = np.asarray(x, dtype=float).ravel()
+        x = x[np.isfinite(x)]
+        if not len(x):
+            return self
+
+        mean = x.mean()
+        self._combine(len(x), mean, np.sum((x - mean)**2))
+        self.min = min(self.min, x.min())
+        self.max = max(self.max, x.max())
+        if self.sketch is not None:
+            self.sketch.update(x)
+        else:
+            self.counts += np.bincount(
+                np.searchsorted(self.bins, x, side='right'), minlength=len(self.counts)
+            )
+        return self
+
+    def merge(self, other):
+        if other.n:
+            if (self.sketch is None) != (other.sketch is None):
+                raise ValueError("Cannot merge StreamStats with and without a quantile sketch.")
+            self._combine(other.n, other.mean, other.M2)
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+            self.counts += other.counts
+            if self.sketch is not None:
+                self.sketch.merge(other.sketch)
+        return self
+
+    @property
+    def std(self):
+        return np.sqrt(self.M2 / (self.n - self.ddof)) if self.n > self.ddof else np.nan
+
+    def quantile(self, q):
+        """
+        Estimate quantile(s) q by linear interpolation within histogram bins (or
+        from the QuantileSketch, if alpha was given). Quantiles among the
+        samples below or above the bins are NaN, except q = 0 and 1 (the min
+        and max).
+        """
+        q = np.asarray(q, dtype=float)
+        if not self.n:
+            return np.full(q.shape, np.nan)
+        if self.sketch is not None:
+            return np.clip(self.sketch.quantile(q), self.min, self.max)
+        cdf = np.cumsum(self.counts)
+        target = q * self.n
+        k = np.clip(np.searchsorted(cdf, target, side='left'), 1, len(self.bins) - 1)
+        frac = (target - cdf[k-1]) / np.maximum(self.counts[k], 1)
+        x = self.bins[k-1] + np.clip(frac, 0, 1) * (self.bins[k] - self.bins[k-1])
+        x = np.clip(x, self.min, self.max)
+
+        outside = (target < self.counts[0]) | (target > self.n - self.counts[-1])
+        outside &= (q > 0) & (q < 1)
+        if np.any(outside):
+            warnings.warn(
+                f"Quantile(s) {q[outside]} fall outside the histogram bins "
+                f"[{self.bins[0]:g}, {self.bins[-1]:g}]; pass alpha to estimate them."
+            )
+            x = np.where(outside, np.nan, x)
+
+        return np.where(q == 0, self.min, np.where(q == 1, self.max, x))
+
+    def summary(self, quantiles=(0.05, 0.5, 0.95)) -> dict:
+        summ = {'n' : self.n, 'mean' : self.mean, 'std' : self.std, 'min' : self.min, 'max' : self.max}
+        summ.update({
+            f"p{round(q * 100):02d}" : x for q,x in zip(quantiles, self.quantile(quantiles))
+        })
+        return summ
+
+#-------------------------------------------------------------------------------
+# SAMPLING
+#-------------------------------------------------------------------------------
+
+def calc_sigma_Ta(T_raw, sn='ALL', date=None):
+    """
+    Standard error [°C] of calibrated air temperature(s) for sensor `sn`, from
+    the calibration registry (see correct_temp.calc_pi()).
+
+    Parameters
+    ----------
+    T_raw : float | array-like
+        Raw (uncorrected) sensor reading(s) [°C], i.e. the input of the
+        calibration, not the calibrated T_a.
+    sn : str | array-like
+        Sensor serial number(s).
+    date : datetime-like | array-like, optional
+        Date(s) of the measurements.
+
+    Raises
+    ------
+    ValueError
+        If the calibration has no RMSE/x_mean, or a standard error is not
+        positive (the residual term alone makes it nonzero for any reading).
+    """
+    sigma = correct_temp.get_registry('C').calc_pi(T_raw, sn=sn, date=date, alpha=None)
+    if not np.all(np.asarray(sigma) > 0.):
+        raise ValueError('Calibration standard error of T_a must be positive.')
+
+    return sigma
+
+def draw_samples(inputs : dict, n, rng, sigmas=None, resids=None) -> dict:
+    """
+    Draw n perturbed samples of each input.
+
+    Parameters
+    ----------
+    inputs : dict
+        Nominal (scalar) value of each input.
+    n : int
+        Number of samples.
+    rng : numpy.random.Generator
+    sigmas : dict, optional
+        Standard deviations of Gaussian errors (e.g. calibration standard errors).
+    resids : dict, optional
+        Arrays of empirical residuals (e.g. the UAV - tower residuals in figs.py),
+        resampled with replacement and added to the inputs.
+
+    Returns
+    -------
+    samples : dict
+        Arrays of length n, clipped to `mc_bounds`.
+    """
+    sigmas = sigmas or {}
+    resids = resids or {}
+    samples = {}
+    for var,x in inputs.items():
+        s = np.full(n, x, dtype=float)
+        if var in sigmas:
+            s += sigmas[var] * rng.standard_normal(n)
+        if var in resids:
+            s += rng.choice(np.asarray(resids[var], dtype=float), n)
+        if var in mc_bounds:
+            np.clip(s, *mc_bounds[var], out=s)
+        samples[var] = s
+
+    return samples
+
+#-------------------------------------------------------------------------------
+# MONTE-CARLO RUNNERS
+#-------------------------------------------------------------------------------
+
+def _run_model(samples, model='LE', **kwargs) -> dict:
+    """
+    Evaluate `model` ('LE' or 'LE_hat') on a chunk of samples (temperatures in °C).
+    """
+    if model == 'LE':
+        return sens.run_le_batch(samples, partials=False, **kwargs)
+
+    z1, z2 = kwargs.pop('z1', 1.5), kwargs.pop('z2', 60.5)
+    air1 = AirLayer(z1, samples['u1'], samples['T_a1'] + 273.15, samples['p_a1'], samples['h_r1'])
+    air2 = AirLayer(z2, samples['u2'], samples['T_a2'] + 273.15, samples['p_a2'], samples['h_r2'])
+    out = sens.run_LE_hat(
+        samples['T_s'] + 273.15, air1, air2, samples['SW_IN'], partials=False, **kwargs
+    )
+    return out
+
+def mc_flight(
+    inputs : dict, sigmas=None, resids=None, n=1_000_000, chunk_size=100_000, model='LE',
+    outputs=('LE', 'H', 'EF'), seed=None, **kwargs
+) -> dict:
+    """
+    Monte-Carlo distribution of the model outputs for one flight.
+
+    Samples are drawn and evaluated `chunk_size` at a time and reduced into
+    StreamStats, so memory is independent of n.
+
+    Parameters
+    ----------
+    inputs : dict
+        Nominal inputs of `model`: for 'LE', T_s, r_H, T_a, h_r, SW_IN, u, p_a; for
+        'LE_hat', T_s, T_a1, h_r1, p_a1, u1, T_a2, h_r2, p_a2, u2, SW_IN.
+        Temperatures in °C.
+    sigmas, resids : dict, optional
+        Input errors (see draw_samples()).
+    n : int, optional
+        Number of samples, by default 1,000,000.
+    chunk_size : int, optional
+        Samples per chunk, by default 100,000.
+    model : str, optional
+        'LE' (run_le_batch()) or 'LE_hat' (run_LE_hat()), by default 'LE'.
+    outputs : tuple, optional
+        Output variables to summarise, by default ('LE', 'H', 'EF').
+    seed : int | numpy.random.SeedSequence, optional
+        Random seed.
+    **kwargs
+        Passed to the model (e.g. G, h, ndvi, z; z1, z2, gamma_i for 'LE_hat').
+
+    Returns
+    -------
+    stats : dict
+        StreamStats of each output.
+    """
+    rng = np.random.default_rng(seed)
+    stats = {var : StreamStats(mc_bins.get(var, mc_bins['LE'])) for var in outputs}
+    fixed = {k : v for k,v in inputs.items() if k not in mc_vars[model]}
+    perturbed = {k : v for k,v in inputs.items() if k in mc_vars[model]}
+
+    for i in range(0, n, chunk_size):
+        m = min(chunk_size, n - i)
+        samples = {
+            **{k : np.full(m, v, dtype=float) for k,v in fixed.items()},
+            **draw_samples(perturbed, m, rng, sigmas, resids),
+        }
+        out = _run_model(samples, model, **kwargs)
+        for var in outputs:
+            stats[var].update(out[var])
+
+    return stats
+
+def _mc_summary(inputs, sigmas, resids, n, chunk_size, model, outputs, seed, quantiles, kwargs) -> dict:
+    """
+    Flattened summary of mc_flight() (module-level so it can be sent to worker
+    processes).
+    """
+    stats = mc_flight(inputs, sigmas, resids, n, chunk_size, model, outputs, seed, **kwargs)
+    return {
+        f"{var}_{k}" : v for var,st in stats.items() for k,v in st.summary(quantiles).items()
+    }
+
+def run_mc(
+    df, sigmas=None, resids=None, n=1_000_000, chunk_size=100_000, model='LE',
+    outputs=('LE', 'H', 'EF'), quantiles=(0.05, 0.5, 0.95), seed=0, n_jobs=None,
+    executor='process', **kwargs
+) -> pd.DataFrame:
+    """
+    Monte-Carlo output distributions for every flight (row) of `df`.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        One row per flight with the inputs of `model` (see mc_flight()).
+    sigmas : dict, optional
+        Standard deviation of each input: a number, or the name of a column of
+        `df` holding per-flight values (e.g. from calc_sigma_Ta() of the raw
+        T_a readings).
+    resids : dict, optional
+        Arrays of residuals of each input, resampled for every flight.
+    seed : int, optional
+        Seed from which independent per-flight streams are spawned, so results
+        do not depend on n_jobs.
+    n_jobs : int, optional
+        If > 1, flights are run concurrently on `n_jobs` workers (`executor` is
+        'process' or 'thread').
+
+    Returns
+    -------
+    mc_df : pandas.DataFrame
+        n, mean, std, min, max and quantiles of each output, indexed like `df`.
+
+    Raises
+    ------
+    ValueError
+        If a sigma column is missing, or a sigma is not finite and non-negative
+        (checked for every flight before any is run).
+    """
+    sigmas = sigmas or {}
+    missing = [v for v in sigmas.values() if isinstance(v, str) and v not in df.columns]
+    if missing:
+        raise ValueError(f"No columns {missing} for the sigmas in df.")
+    sig_df = pd.DataFrame(
+        {k : df[v] if isinstance(v, str) else v for k,v in sigmas.items()}, index=df.index
+    ).astype(float)
+    bad = ~(np.isfinite(sig_df) & (sig_df >= 0.)).all()
+    if bad.any():
+        raise ValueError(
+            f"Sigmas of {list(bad.index[bad])} must be finite and non-negative for every flight."
+        )
+    in_cols = [c for c in df.columns if c in mc_vars[model] or c in ('u', 'u1', 'u2')]
+    seeds = np.random.SeedSequence(seed).spawn(len(df))
+
+    arg_list = []
+    for (_,row),(_,sig),ss in zip(df.iterrows(), sig_df.iterrows(), seeds):
+        sig = sig.to_dict()
+        arg_list.append((
+            row[in_cols].to_dict(), sig, resids, n, chunk_size, model, outputs, ss, quantiles, kwargs
+        ))
+
+    if n_jobs and n_jobs > 1:
+        results = list(sens._map_ordered(_mc_summary, arg_list, n_jobs, executor))
+    else:
+        results = [_mc_summary(*args) for args in arg_list]
+
+    mc_df = pd.DataFrame(results, index=df.index)
+
+    return mc_df
+
+
+#-------------------------------------------------------------------------------
+# GLOBAL SENSITIVITY (SOBOL INDICES)
+#-------------------------------------------------------------------------------
+
+def saltelli_sample(bounds : dict, n=2**13, seed=None):
+    """
+    Saltelli sampling matrices from a scrambled Sobol' sequence.
+
+    Parameters
+    ----------
+    bounds : dict
+        (lower, upper) bounds of each of the k varied inputs.
+    n : int, optional
+        Base sample size (rounded up to a power of 2), by default 2**13.
+    seed : int, optional
+        Seed of the scrambling.
+
+    Returns
+    -------
+    A, B : numpy.ndarray
+        Independent (n, k) sample matrices.
+    AB : numpy.ndarray
+        (k, n, k) matrices, AB[i] being A with column i taken from B.
+    """
+    k = len(bounds)
+    lo, hi = np.array(list(bounds.values()), dtype=float).T
+    AB_base = qmc.Sobol(d=2 * k, scramble=True, seed=seed).random_base2(int(np.ceil(np.log2(n))))
+    A = qmc.scale(AB_base[:,:k], lo, hi)
+    B = qmc.scale(AB_base[:,k:], lo, hi)
+
+    AB = np.repeat(A[None], k, axis=0)
+    for i in range(k):
+        AB[i,:,i] = B[:,i]
+
+    return A, B, AB
+
+def sobol_indices(f_A, f_B, f_AB, n_boot=100, conf=0.95, seed=None) -> dict:
+    """
+    First-order (Saltelli et al., 2010) and total (Jansen, 1999) Sobol' indices.
+
+    Parameters
+    ----------
+    f_A, f_B : numpy.ndarray
+        Model outputs for A and B, shape (n,).
+    f_AB : numpy.ndarray
+        Model outputs for AB, shape (k, n).
+    n_boot : int, optional
+        Number of bootstrap resamples for the confidence intervals, by default 100.
+    conf : float, optional
+        Confidence level, by default 0.95.
+
+    Returns
+    -------
+    S : dict
+        Arrays S1, ST and their bootstrap half-widths S1_conf, ST_conf (length k).
+    """
+    # Drop samples where any evaluation is non-finite
+    ok = np.isfinite(f_A) & np.isfinite(f_B) & np.isfinite(f_AB).all(axis=0)
+    f_A, f_B, f_AB = f_A[ok], f_B[ok], f_AB[:,ok]
+
+    def _calc(idx):
+        a, b, ab = f_A[idx], f_B[idx], f_AB[:,idx]
+        var = np.var(np.concatenate([a, b]))
+        S1 = np.mean(b * (ab - a), axis=1) / var
+        ST = 0.5 * np.mean((a - ab)**2, axis=1) / var
+        return S1, ST
+
+    n = len(f_A)
+    S1, ST = _calc(np.arange(n))
+    S = {'S1' : S1, 'ST' : ST}
+
+    if n_boot:
+        rng = np.random.default_rng(seed)
+        boot = [_calc(rng.integers(0, n, n)) for _ in range(n_boot)]
+        z = stats.norm.ppf(0.5 + conf / 2)
+        S['S1_conf'] = z * np.std([b[0] for b in boot], axis=0, ddof=1)
+        S['ST_conf'] = z * np.std([b[1] for b in boot], axis=0, ddof=1)
+
+    return S
+
+def calc_sobol(
+    bounds=sobol_bounds, n=2**13, output='LE', fixed={'SW_IN' : 650., 'u' : 3.0, 'p_a' : 99.6},
+    n_boot=100, seed=None, chunk_size=100_000, **kwargs
+) -> pd.DataFrame:
+    """
+    Sobol' indices of a run_le_batch() output over the ranges swept by 
+    generate_partials().
+
+    All n * (k + 2) model evaluations are made in one batched, vectorised call. 
+    With the defaults this is 49,152 evaluations (vs. ~3.1 million for the 
+    default generate_partials() grid).
+
+    Parameters
+    ----------
+    bounds : dict, optional
+        (lower, upper) bounds of the varied inputs, by default `sobol_bounds`.
+    n : int, optional
+        Base sample size (a power of 2), by default 2**13.
+    output : str, optional
+        Output of run_le_batch() to analyse, by default 'LE'.
+    fixed : dict, optional
+        Values of the inputs in `sens.batch_vars` that are not varied.
+    **kwargs
+        Passed to run_le_batch() (G, h, ndvi, z).
+
+    Returns
+    -------
+    S_df : pandas.DataFrame
+        S1, ST (and their confidence half-widths), indexed by input.
+    """
+    A, B, AB = saltelli_sample(bounds, n, seed)
+    k, n = AB.shape[:2]
+    X = np.concatenate([A, B, AB.reshape(-1, k)])
+
+    data = {var : np.full(len(X), fixed.get(var, np.nan)) for var in sens.batch_vars}
+    data.update({var : X[:,i] for i,var in enumerate(bounds)})
+    f = sens.run_le_batch(data, partials=False, chunk_size=chunk_size, **kwargs)[output].to_numpy()
+
+    S = sobol_indices(f[:n], f[n:2*n], f[2*n:].reshape(k, n), n_boot=n_boot, seed=seed)
+    S_df = pd.DataFrame(S, index=list(bounds))
+
+    return S_df